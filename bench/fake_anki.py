@@ -0,0 +1,271 @@
+"""Stand-in AnkiConnect server backed by an in-memory synthetic collection."""
+import base64
+import fnmatch
+import io
+import json
+import os
+import random
+import shlex
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "note_process"))
+
+import examples  # noqa: E402
+
+
+def silent_wav(seconds, rate=16000):
+    """Return a mono 16 bit wav file of low noise."""
+    frames = int(seconds * rate)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(struct.pack(f"<{frames}h", *(
+            random.randint(-64, 64) for _ in range(frames))))
+    return buffer.getvalue()
+
+
+class Collection:
+    """Notes, tags and media files, guarded by one lock."""
+
+    def __init__(self, media_dir):
+        self.notes = {}
+        self.media_dir = media_dir
+        self.lock = threading.Lock()
+        self.next_id = 1_700_000_000_000
+
+    def add_note(self, model, fields, tags=()):
+        with self.lock:
+            self.next_id += 1
+            self.notes[self.next_id] = dict(
+                noteId=self.next_id,
+                modelName=model,
+                tags=list(tags),
+                fields={
+                    name: dict(value=value, order=order)
+                    for order, (name, value) in enumerate(fields.items())
+                },
+                added=time.time())
+            return self.next_id
+
+    def matches(self, note, term):
+        negate = term.startswith("-")
+        term = term.lstrip("-")
+        key, _, value = term.partition(":")
+        if not _:
+            text = " ".join(field["value"] for field in note["fields"].values())
+            result = term.lower() in text.lower()
+        elif key == "note":
+            result = fnmatch.fnmatchcase(note["modelName"], value)
+        elif key == "tag":
+            result = any(fnmatch.fnmatchcase(tag, value) for tag in note["tags"])
+        elif key == "deck":
+            result = True
+        elif key == "added":
+            result = note["added"] >= time.time() - int(value) * 86400
+        elif key == "nid":
+            result = str(note["noteId"]) in value.split(",")
+        else:
+            field = note["fields"].get(key)
+            result = field is not None and fnmatch.fnmatchcase(
+                field["value"], value.replace("_", "?"))
+        return result != negate
+
+    def find_notes(self, query):
+        terms = shlex.split(query)
+        with self.lock:
+            return [
+                note_id for note_id, note in self.notes.items()
+                if all(self.matches(note, term) for term in terms)
+            ]
+
+
+def populate(collection, mining_notes, vocabulary_notes, subtitle_notes, audio_seconds,
+             same_line=1):
+    """Fill the collection with synthetic notes derived from examples.py.
+
+    Every same_line consecutive mining notes are mined from the same subtitle line."""
+    random.seed(0)
+    audio = silent_wav(audio_seconds)
+    for i in range(mining_notes):
+        line = i // same_line
+        example = examples.extract_sentences[line % len(examples.extract_sentences)]["input"]
+        file_name = f"raw_sentence_audio_{i}.wav"
+        with open(os.path.join(collection.media_dir, file_name), "wb") as audio_file:
+            audio_file.write(audio)
+        collection.add_note("Mining", {
+            "Raw Yomitan Expression": example["vocabulary"],
+            "Raw Yomitan Sentence": example["guide"],
+            "Raw Sentence Japanese": example["subtitle_japanese"],
+            "Raw Sentence English": example["subtitle_english"],
+            "Raw Sentence Audio": f"[sound:{file_name}]",
+            "Sentence Japanese": "",
+            "Sentence Furigana": "",
+            "Sentence English": "",
+            "Sentence Audio": "",
+            "Subtitle Japanese": example["subtitle_japanese"] + "（ナレーション）",
+            "Subtitle English": example["subtitle_english"] + " (narrator)",
+        })
+
+    readings = ["かみ", "はし", "あめ", "きる", "かう", "せいしき", "こうえん"]
+    for i in range(vocabulary_notes):
+        reading = readings[i % len(readings)]
+        collection.add_note("Core 2000 Vocabulary", {
+            "Expression": f"{reading}{i % 3}",
+            "Reading": reading if i % 5 else "",
+            "Meaning": f"meaning {i}",
+            "Similar": "",
+            "Alternative": "",
+        })
+
+    for i in range(subtitle_notes):
+        collection.add_note("Mining", {
+            "Subtitle Japanese": f"字幕{i}（効果音）です",
+            "Subtitle English": f"subtitle {i} (sound effect)",
+        }, tags=["generated-0"])
+
+
+class AnkiConnect:
+    """Dispatches AnkiConnect actions to the collection."""
+
+    def __init__(self, collection, latency=0.0):
+        self.collection = collection
+        self.latency = latency
+        self.requests = []
+        self.requests_lock = threading.Lock()
+
+    def handle(self, action, params):
+        method = getattr(self, action, None)
+        if method is None:
+            raise ValueError(f"unsupported action {action}")
+        return method(**params)
+
+    def reply(self, request):
+        """Answer a request the way AnkiConnect does for its version.
+
+        Up to version 4 a result comes back as it is, only an error is
+        wrapped; later versions always wrap the result with its error."""
+        version = request.get("version", 4)
+        try:
+            result = self.handle(request["action"], request.get("params", {}))
+        except Exception as e:
+            return dict(result=None, error=str(e))
+        return result if version <= 4 else dict(result=result, error=None)
+
+    def version(self):
+        return 6
+
+    def multi(self, actions):
+        return [self.reply(item) for item in actions]
+
+    def findNotes(self, query):
+        return self.collection.find_notes(query)
+
+    def notesInfo(self, notes):
+        with self.collection.lock:
+            return [
+                {key: value for key, value in self.collection.notes[note_id].items()
+                 if key != "added"}
+                for note_id in notes if note_id in self.collection.notes
+            ]
+
+    def updateNoteFields(self, note):
+        with self.collection.lock:
+            fields = self.collection.notes[note["id"]]["fields"]
+            for name, value in note["fields"].items():
+                fields.setdefault(name, dict(value="", order=len(fields)))["value"] = value
+
+    def addTags(self, notes, tags):
+        with self.collection.lock:
+            for note_id in notes:
+                note_tags = self.collection.notes[note_id]["tags"]
+                note_tags.extend(tag for tag in tags.split() if tag not in note_tags)
+
+    def getMediaDirPath(self):
+        return self.collection.media_dir
+
+    def getMediaFilesNames(self, pattern="*"):
+        return fnmatch.filter(os.listdir(self.collection.media_dir), pattern)
+
+    def retrieveMediaFile(self, filename):
+        path = os.path.join(self.collection.media_dir, filename)
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as media_file:
+            return base64.b64encode(media_file.read()).decode("utf-8")
+
+    def storeMediaFile(self, filename, data=None, path=None, url=None, deleteExisting=True):
+        target = os.path.join(self.collection.media_dir, filename)
+        if path is not None:
+            shutil.copyfile(path, target)
+        else:
+            with open(target, "wb") as media_file:
+                media_file.write(base64.b64decode(data))
+        return filename
+
+    def deleteMediaFile(self, filename):
+        path = os.path.join(self.collection.media_dir, filename)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def serve(anki, port=0):
+    """Start the server on a background thread and return it."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            start = time.perf_counter()
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if anki.latency:
+                time.sleep(anki.latency)
+            data = json.dumps(anki.reply(request)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            with anki.requests_lock:
+                anki.requests.append((request["action"], time.perf_counter() - start))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake AnkiConnect server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mining-notes", type=int, default=20)
+    parser.add_argument("--vocabulary-notes", type=int, default=200)
+    parser.add_argument("--subtitle-notes", type=int, default=200)
+    parser.add_argument("--audio-seconds", type=float, default=8.0)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds added to every request.")
+    args = parser.parse_args()
+
+    collection = Collection(tempfile.mkdtemp(prefix="fake_anki_media_"))
+    populate(collection, args.mining_notes, args.vocabulary_notes,
+             args.subtitle_notes, args.audio_seconds)
+    server = serve(AnkiConnect(collection, args.latency), args.port)
+    print(f"fake AnkiConnect on http://127.0.0.1:{server.server_port}, "
+          f"media in {collection.media_dir}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""OpenAI-compatible stub that answers from note_process/examples.py."""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "note_process"))
+
+import examples  # noqa: E402
+
+
+def lookup(items, key, value):
+    """Return the example whose input has the given value, None if there is none."""
+    for item in items:
+        if item["input"].get(key) == value:
+            return item
+    return None
+
+
+def answer_extract(content):
+    example = lookup(examples.extract_sentences, "vocabulary", content.get("vocabulary"))
+    if example is not None:
+        return example["output"]
+    return dict(sentence_japanese=content.get("guide", ""), sentence_english="")
+
+
+def answer_extract_split(content):
+    example = lookup(examples.extract_split_sentences, "vocabulary", content.get("vocabulary"))
+    if example is not None:
+        return example["output"]
+    extracted = answer_extract(content)
+    split = answer_split([
+        dict(vocabulary=content.get("vocabulary", ""), sentence=sentence)
+        for sentence in extracted.values()])["split_sentences"]
+    return dict(sentence_japanese=split[0], sentence_english=split[1])
+
+
+def answer_furigana(content):
+    example = lookup(examples.augment_furigana, "sentence", content.get("sentence"))
+    if example is not None:
+        return example["output"]
+    return dict(furigana=content.get("sentence", ""))
+
+
+def answer_split(content):
+    known = {
+        split_in["sentence"]: split_out
+        for example in examples.split_sentences
+        for split_in, split_out in zip(example["input"], example["output"]["split_sentences"])
+    }
+    out = []
+    for item in content:
+        sentence = item["sentence"]
+        if sentence in known:
+            out.append(known[sentence])
+            continue
+        index = sentence.find(item["vocabulary"])
+        end = index + len(item["vocabulary"])
+        if index < 0:
+            # no literal match, as in english sentences: take the first word
+            index = 0
+            end = len(sentence.split(" ")[0])
+        out.append(dict(prefix=sentence[:index],
+                        middle=sentence[index:end], suffix=sentence[end:]))
+    return dict(split_sentences=out)
+
+
+def answer_cut_range(content):
+    example = lookup(examples.find_japanese_sentence,
+                     "japanese_sentence", content.get("japanese_sentence"))
+    if example is not None:
+        return example["output"]
+    words = [word for word in content.get("transcription", []) if "start" in word]
+    return dict(begin=words[0]["start"] if words else 0.0,
+                end=words[-1]["end"] if words else 0.0)
+
+
+def answer_chat(request):
+    """Build a structured output answer matching the requested schema."""
+    schema = request["response_format"]["json_schema"]["schema"]
+    properties = schema.get("properties", {})
+    content = None
+    for message in reversed(request["messages"]):
+        if message["role"] != "user":
+            continue
+        # repair requests follow the payload as plain text
+        try:
+            content = json.loads(message["content"])
+            break
+        except json.JSONDecodeError:
+            continue
+
+    if "split_sentences" in properties:
+        return answer_split(content)
+    if "furigana" in properties:
+        return answer_furigana(content)
+    if "begin" in properties:
+        return answer_cut_range(content)
+    if properties.get("sentence_japanese", {}).get("type") != "string":
+        return answer_extract_split(content)
+    return answer_extract(content)
+
+
+def answer_transcription(body):
+    """Replay the example transcription whose sentence appears in the prompt."""
+    chosen = examples.find_japanese_sentence[0]
+    for example in examples.find_japanese_sentence:
+        if example["input"]["japanese_sentence"].encode("utf-8") in body:
+            chosen = example
+            break
+
+    words = []
+    last = 0.0
+    for word in chosen["input"]["transcription"]:
+        start = word.get("start", last)
+        end = word.get("end", start)
+        words.append(dict(word=word["text"], start=start, end=end))
+        last = end
+    return dict(task="transcribe", language="japanese", duration=last,
+                text="".join(word["word"] for word in words), words=words)
+
+
+class FakeOpenAI:
+    """Answers chat completions and transcriptions after a configurable delay.
+
+    With rpm set, every endpoint has a bucket of rpm requests refilled
+    continuously over a minute, reports it in rate limit headers and
+    answers 429 when it is empty."""
+
+    def __init__(self, chat_latency=0.0, transcription_latency=0.0, rpm=None):
+        self.chat_latency = chat_latency
+        self.transcription_latency = transcription_latency
+        self.rpm = rpm
+        self.sent = {}
+        self.requests = []
+        self.requests_lock = threading.Lock()
+
+    def admit(self, path):
+        """Rate limit headers for a request, None if it is over the limit."""
+        if self.rpm is None:
+            return {}
+        now = time.monotonic()
+        with self.requests_lock:
+            level, updated = self.sent.get(path, (self.rpm, now))
+            level = min(self.rpm, level + self.rpm / 60 * (now - updated))
+            if level < 1:
+                self.sent[path] = (level, now)
+                return None
+            level -= 1
+            self.sent[path] = (level, now)
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(int(level)),
+            "x-ratelimit-reset-requests": f"{(self.rpm - level) * 60 / self.rpm:.3f}s",
+        }
+
+    def chat(self, body):
+        request = json.loads(body)
+        time.sleep(self.chat_latency)
+        content = json.dumps(answer_chat(request), ensure_ascii=False)
+        prompt_tokens = len(json.dumps(request["messages"], ensure_ascii=False)) // 3
+        return dict(
+            id="chatcmpl-fake",
+            object="chat.completion",
+            created=int(time.time()),
+            model=request["model"],
+            choices=[dict(
+                index=0,
+                message=dict(role="assistant", content=content, refusal=None),
+                finish_reason="stop",
+                logprobs=None)],
+            usage=dict(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=len(content) // 3,
+                total_tokens=prompt_tokens + len(content) // 3,
+                prompt_tokens_details=dict(cached_tokens=0)))
+
+    def transcription(self, body):
+        time.sleep(self.transcription_latency)
+        return answer_transcription(body)
+
+
+def serve(openai, port=0):
+    """Start the server on a background thread and return it."""
+    routes = {
+        "/v1/chat/completions": openai.chat,
+        "/v1/audio/transcriptions": openai.transcription,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            start = time.perf_counter()
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            route = routes.get(self.path)
+            if route is None:
+                self.send_error(404)
+                return
+            headers = openai.admit(self.path)
+            if headers is None:
+                with openai.requests_lock:
+                    openai.requests.append((self.path + " 429", time.perf_counter() - start))
+                data = json.dumps(dict(error=dict(
+                    message="Rate limit reached", type="requests", code="rate_limit_exceeded")))
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("retry-after", "1")
+                self.end_headers()
+                self.wfile.write(data.encode("utf-8"))
+                return
+            data = json.dumps(route(body), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            with openai.requests_lock:
+                openai.requests.append((self.path, time.perf_counter() - start))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI server.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--chat-latency", type=float, default=0.0)
+    parser.add_argument("--transcription-latency", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, help="Requests per minute per endpoint.")
+    args = parser.parse_args()
+
+    server = serve(FakeOpenAI(args.chat_latency, args.transcription_latency, args.rpm),
+                   args.port)
+    print(f"fake OpenAI on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Run the scripts end to end against fake AnkiConnect and OpenAI servers.
+
+    python bench/run.py --mining-notes 20 --chat-latency 0.3 --repeat 3
+
+Every run starts from a freshly generated collection and without the
+artifacts and fingerprints stored by earlier runs, so numbers are
+comparable between commits and between scripts.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_anki
+import fake_openai
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCRIPTS = {
+    "link_similar_notes": dict(
+        args=["link_similar_notes.py"], cwd=ROOT, note_type="Core 2000 Vocabulary"),
+    "subtitle_cleanup": dict(
+        args=["subtitle_cleanup.py"], cwd=ROOT, note_type="Mining"),
+    "cleanup": dict(
+        args=["cleanup.py", "--process-unprocessed"],
+        cwd=os.path.join(ROOT, "note_process"), note_type="Mining", state=True),
+    "cleanup_stream": dict(
+        args=["cleanup.py", "--process-unprocessed", "--stream"],
+        cwd=os.path.join(ROOT, "note_process"), note_type="Mining", state=True),
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(requests):
+    """Group (endpoint, seconds) pairs into count, p50 and p95 per endpoint."""
+    grouped = {}
+    for endpoint, seconds in requests:
+        grouped.setdefault(endpoint, []).append(seconds)
+    return {
+        endpoint: (len(values), percentile(values, 0.5), percentile(values, 0.95))
+        for endpoint, values in sorted(grouped.items())
+    }
+
+
+def run_script(name, args):
+    """Run one script against fresh fake servers and return its measurements."""
+    script = SCRIPTS[name]
+    collection = fake_anki.Collection(tempfile.mkdtemp(prefix="fake_anki_media_"))
+    fake_anki.populate(collection, args.mining_notes, args.vocabulary_notes,
+                       args.subtitle_notes, args.audio_seconds, args.same_line)
+    anki = fake_anki.AnkiConnect(collection, args.anki_latency)
+    openai = fake_openai.FakeOpenAI(args.chat_latency, args.transcription_latency,
+                                    args.openai_rpm)
+    anki_server = fake_anki.serve(anki)
+    openai_server = fake_openai.serve(openai)
+
+    env = dict(
+        os.environ,
+        ANKICONNECT_URL=f"http://127.0.0.1:{anki_server.server_port}",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_server.server_port}/v1",
+        OPENAI_API_KEY="fake")
+    notes = len(collection.find_notes(f"\"note:{script['note_type']}\""))
+    if name.startswith("cleanup"):
+        notes = len(collection.find_notes("-tag:generated-0 note:Mining"))
+
+    command = [sys.executable] + script["args"]
+    state_dir = None
+    if script.get("state"):
+        # stored artifacts and fingerprints of earlier runs would make this one warm
+        state_dir = tempfile.mkdtemp(prefix="bench_state_")
+        command += ["--artifacts", os.path.join(state_dir, "artifacts"),
+                    "--fingerprints", os.path.join(state_dir, "fingerprints.sqlite")]
+
+    start = time.perf_counter()
+    completed = subprocess.run(
+        command, cwd=script["cwd"], env=env,
+        capture_output=True, text=True)
+    wall = time.perf_counter() - start
+
+    anki_server.shutdown()
+    openai_server.shutdown()
+    if state_dir is not None:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    if completed.returncode != 0:
+        print(completed.stdout[-2000:])
+        print(completed.stderr[-2000:])
+        raise SystemExit(f"{name} exited with {completed.returncode}")
+
+    failed = completed.stdout.count("Error processing note")
+    return dict(wall=wall, notes=notes, failed=failed,
+                anki=summarize(anki.requests), openai=summarize(openai.requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark.")
+    parser.add_argument("scripts", nargs="*", default=list(SCRIPTS),
+                        help=f"Scripts to run, out of {', '.join(SCRIPTS)}.")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--mining-notes", type=int, default=20)
+    parser.add_argument("--vocabulary-notes", type=int, default=200)
+    parser.add_argument("--subtitle-notes", type=int, default=200)
+    parser.add_argument("--audio-seconds", type=float, default=8.0)
+    parser.add_argument("--same-line", type=int, default=1,
+                        help="Mine this many consecutive notes from the same subtitle line.")
+    parser.add_argument("--anki-latency", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.0)
+    parser.add_argument("--transcription-latency", type=float, default=0.0)
+    parser.add_argument("--openai-rpm", type=int,
+                        help="Rate limit every fake OpenAI endpoint to this many requests per minute.")
+    args = parser.parse_args()
+    for name in args.scripts:
+        if name not in SCRIPTS:
+            parser.error(f"unknown script {name}")
+
+    for name in args.scripts:
+        for attempt in range(args.repeat):
+            result = run_script(name, args)
+            print(f"{name} #{attempt + 1}: {result['notes']} notes in "
+                  f"{result['wall']:.2f}s, {result['notes'] / result['wall']:.1f} notes/s, "
+                  f"{result['failed']} failed")
+            for server in ("anki", "openai"):
+                for endpoint, (count, p50, p95) in result[server].items():
+                    print(f"  {server} {endpoint}: {count} requests, "
+                          f"p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare transcription throughput of the hosted and the local backend.
+
+    python bench/transcribe.py clip1.mp3 clip2.mp3 --backends openai local --jobs 4
+
+With --batch N every backend is also run with up to N concurrent clips
+joined into one request, to compare against one request per clip.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "note_process"))
+
+import speech  # noqa: E402
+
+
+def audio_duration(path):
+    """Return the clip length in seconds, 0 if ffprobe is not available."""
+    try:
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            check=True, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return 0.0
+
+
+def run(backend, clips, jobs):
+    """Transcribe every clip once and return the per-clip latencies and the wall time."""
+    def timed(path):
+        start = time.perf_counter()
+        backend.transcribe(path, "")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        latencies = list(executor.map(timed, clips))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcription backends.")
+    parser.add_argument("clips", nargs="+", help="Audio files to transcribe.")
+    parser.add_argument("--backends", nargs="+", choices=speech.backends,
+                        default=list(speech.backends))
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Concurrent transcriptions.")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Transcribe the clip list this many times.")
+    parser.add_argument("--whisper-model", default="small",
+                        help="Model size for the local backend.")
+    parser.add_argument("--batch", type=int,
+                        help="Also run with up to this many clips per request.")
+    args = parser.parse_args()
+
+    clips = args.clips * args.repeat
+    audio_seconds = sum(audio_duration(path) for path in clips)
+
+    for name in args.backends:
+        if name == "local":
+            backend = speech.use_backend(
+                name, model_size=args.whisper_model, num_workers=args.jobs)
+            # model loading is a one-time cost and not part of the throughput
+            load_start = time.perf_counter()
+            backend.load()
+            print(f"{name}: model loaded in {time.perf_counter() - load_start:.2f}s")
+        else:
+            backend = speech.use_backend(name)
+
+        variants = [(name, backend)]
+        if args.batch:
+            variants.append((f"{name} batched", speech.BatchingBackend(backend, max_clips=args.batch)))
+        for label, variant in variants:
+            latencies, wall = run(variant, clips, args.jobs)
+            latencies.sort()
+            print(f"{label}: {len(clips)} clips in {wall:.2f}s, "
+                  f"{len(clips) / wall:.2f} clips/s, "
+                  f"p50 {latencies[len(latencies) // 2]:.2f}s, "
+                  f"max {latencies[-1]:.2f}s")
+            if audio_seconds:
+                print(f"{label}: {audio_seconds / wall:.1f}x realtime")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
+import os
 import requests
 from collections import defaultdict
 
 # AnkiConnect API configuration
-ANKI_CONNECT_URL = "http://localhost:8765"
+ANKI_CONNECT_URL = os.environ.get("ANKICONNECT_URL", "http://localhost:8765")
 
 
 def invoke(action, params):
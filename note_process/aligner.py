@@ -0,0 +1,84 @@
+import unicodedata
+from common import *
+from typing import Optional
+
+try:
+    import pykakasi
+    kakasi = pykakasi.kakasi()
+except ImportError:
+    kakasi = None
+
+MATCH = 2
+MISMATCH = -1
+GAP = -1
+
+
+def to_kana(text: str) -> str:
+    """Normalize text to hiragana without punctuation and whitespace.
+
+    Kanji are converted to their reading when pykakasi is installed,
+    otherwise they are compared by surface form."""
+    text = unicodedata.normalize("NFKC", text)
+    if kakasi is not None:
+        text = "".join(item["hira"] for item in kakasi.convert(text))
+    text = "".join(
+        chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch
+        for ch in text)
+    return "".join(
+        ch for ch in text
+        if unicodedata.category(ch)[0] in "LN")
+
+
+def smith_waterman(query: str, target: str):
+    """Locally align query against target.
+
+    Returns (score, begin, end) with target[begin:end] being the aligned span."""
+    best = (0, 0, 0)
+    # each cell holds (score, begin of the alignment in target)
+    previous = [(0, j) for j in range(len(target) + 1)]
+    for i in range(1, len(query) + 1):
+        current = [(0, 0)]
+        for j in range(1, len(target) + 1):
+            diagonal = previous[j - 1][0] + \
+                (MATCH if query[i - 1] == target[j - 1] else MISMATCH)
+            cell = max(
+                (diagonal, previous[j - 1][1]),
+                (previous[j][0] + GAP, previous[j][1]),
+                (current[j - 1][0] + GAP, current[j - 1][1]),
+                key=lambda c: c[0])
+            if cell[0] <= 0:
+                cell = (0, j)
+            current.append(cell)
+            if cell[0] > best[0]:
+                best = (cell[0], cell[1], j)
+        previous = current
+    return best
+
+
+def align_sentence(japanese_sentence: str, transcription: list):
+    """Align the sentence against the word-level transcription.
+
+    Returns (cut_range, confidence), confidence being the alignment score
+    relative to a perfect match of the whole sentence."""
+    query = to_kana(japanese_sentence)
+    target = ""
+    owners = []
+    for index, word in enumerate(transcription):
+        kana = to_kana(word["text"])
+        target += kana
+        owners.extend([index] * len(kana))
+    if not query or not target:
+        return None, 0.0
+
+    score, begin, end = smith_waterman(query, target)
+    if score <= 0:
+        return None, 0.0
+
+    words = transcription[owners[begin]:owners[end - 1] + 1]
+    starts = [word["start"] for word in words if word.get("start") is not None]
+    ends = [word["end"] for word in words if word.get("end") is not None]
+    if not starts or not ends:
+        return None, 0.0
+
+    confidence = score / (MATCH * len(query))
+    return CutRange(begin=starts[0], end=ends[-1]), confidence
@@ -0,0 +1,21 @@
+import os
+import requests
+import cassette
+
+ANKICONNECT_URL = os.environ.get("ANKICONNECT_URL", "http://127.0.0.1:8765")
+
+# keeps the connection to AnkiConnect open between calls
+session = requests.Session()
+
+
+def invoke(action, **params):
+    """Helper function to interact with AnkiConnect."""
+    return cassette.wrap(
+        "ankiconnect",
+        lambda: dict(action=action, params=params),
+        lambda: session.post(
+            ANKICONNECT_URL, json={"action": action,
+                                   "version": 6, "params": params}
+        ).json(),
+        lambda response: response,
+        lambda response: response)
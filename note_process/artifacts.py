@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# directory of the artifacts derived from note audio, by content hash
+path = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "anki-note-process", "artifacts")
+# bytes the artifacts may take on disk, the least recently used go first;
+# 0 turns the store off
+max_bytes = 256 << 20
+
+lock = threading.Lock()
+connection = None
+
+
+def connect():
+    global connection
+    if connection is None:
+        os.makedirs(path, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=60,
+                                     isolation_level=None, check_same_thread=False)
+        connection.execute(
+            "create table if not exists artifacts ("
+            " key text primary key, size integer, used real)")
+    return connection
+
+
+def file_path(key) -> str:
+    return os.path.join(path, key)
+
+
+def get(key):
+    """Bytes stored under key, None if there are none."""
+    if not max_bytes:
+        return None
+    with lock:
+        row = connect().execute("select 1 from artifacts where key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        connect().execute("update artifacts set used = ? where key = ?", (time.time(), key))
+    try:
+        with open(file_path(key), "rb") as artifact_file:
+            return artifact_file.read()
+    except FileNotFoundError:
+        # evicted by another process in the meantime
+        return None
+
+
+def put(key, data: bytes):
+    """Store data under key, then evict the least recently used beyond max_bytes."""
+    if not max_bytes:
+        return
+    with lock:
+        connection = connect()
+        # written aside and renamed, so a reader never sees a partial file
+        with tempfile.NamedTemporaryFile(dir=path, delete=False) as artifact_file:
+            artifact_file.write(data)
+        os.replace(artifact_file.name, file_path(key))
+        connection.execute(
+            "insert or replace into artifacts (key, size, used) values (?, ?, ?)",
+            (key, len(data), time.time()))
+        (total,) = connection.execute("select coalesce(sum(size), 0) from artifacts").fetchone()
+        if total <= max_bytes:
+            return
+        evicted = []
+        for old_key, size in connection.execute(
+                "select key, size from artifacts order by used").fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append(old_key)
+            total -= size
+        connection.executemany("delete from artifacts where key = ?", [(k,) for k in evicted])
+        for old_key in evicted:
+            try:
+                os.remove(file_path(old_key))
+            except FileNotFoundError:
+                pass
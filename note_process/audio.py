@@ -1,57 +1,180 @@
 from common import *
 
+import re
 import openai
 import subprocess
 import tempfile
 import examples
+import speech
+from aligner import *
+from prompts import *
+from validation import *
+import artifacts
+import singleflight
+from fingerprints import fingerprint
+
+# below this alignment confidence the model is asked for the range instead
+align_threshold = 0.6
+# convert audio to mono 16 kHz low bitrate mp3 before it is transcribed
+downsample = True
+# also cut leading and trailing non-speech longer than min_silence seconds,
+# keeping trim_padding seconds of it
+trim_silence = False
+silence_noise = "-35dB"
+min_silence = 0.5
+trim_padding = 0.25
+
+SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+DURATION = re.compile(r"Duration: (\d+):(\d+):([\d.]+)")
+
+
+def detect_speech(audio_path: str) -> (float, Optional[float]):
+    """Begin and end of the speech in the audio, by ffmpeg silence detection.
+
+    end is None when the audio does not end in silence. Audio without a
+    known duration is not trimmed."""
+    completed = subprocess.run(
+        ["ffmpeg", "-i", audio_path,
+         "-af", f"silencedetect=noise={silence_noise}:d={min_silence}",
+         "-f", "null", "-"],
+        check=True, capture_output=True, text=True)
+    log = completed.stderr
+    starts = [float(value) for value in SILENCE_START.findall(log)]
+    ends = [float(value) for value in SILENCE_END.findall(log)]
+    match = DURATION.search(log)
+    if match is None:
+        # no duration known ("Duration: N/A"), leave the audio untrimmed
+        return 0.0, None
+    hours, minutes, seconds = match.groups()
+    duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    begin = 0.0
+    if starts and starts[0] <= 0.01 and ends:
+        begin = ends[0]
+    end = None
+    if starts and starts[-1] > begin and (len(ends) < len(starts) or ends[-1] >= duration - 0.01):
+        end = starts[-1]
+    if begin >= duration or (end is not None and end <= begin):
+        # silence throughout, leave it to the transcription
+        return 0.0, None
+    return begin, end
+
+
+def prepare_audio(audio_path: str) -> (AudioRef, float):
+    """Downsample the audio for transcription, trimmed if enabled.
+
+    Returns the temporary file and the offset of its start in the original."""
+    begin, end = 0.0, None
+    if trim_silence:
+        begin, end = detect_speech(audio_path)
+        begin = max(begin - trim_padding, 0.0)
+        end = None if end is None else end + trim_padding
+    output_path = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False).name
+    command = ["ffmpeg", "-i", audio_path, "-ss", str(begin)]
+    if end is not None:
+        command += ["-to", str(end)]
+    command += ["-ac", "1", "-ar", "16000", "-b:a", "32k", output_path, "-y"]
+    subprocess.run(command, check=True, capture_output=True)
+    prepared = AudioRef(path=output_path, temporary=True)
+    stats["transcription.source_bytes"] += os.path.getsize(audio_path)
+    stats["transcription.upload_bytes"] += prepared.size()
+    return prepared, begin
+
+
+def transcription_settings() -> dict:
+    """Settings that change the timestamps of a transcription.
+
+    They are part of the audio fingerprint and the transcription key, so
+    changing a default here makes the audio stage of every note stale."""
+    return dict(downsample=downsample, trim_silence=trim_silence and dict(
+        noise=silence_noise, min_silence=min_silence, padding=trim_padding))
+
 
+def transcription_key(audio_path: str) -> str:
+    """Identity of a transcription: the audio content and how it is transcribed.
 
-class CutRange(BaseModel):
-    begin: float
-    end: float
+    The sentence given to the backend is only a hint, an edited sentence
+    does not transcribe the same audio again."""
+    return fingerprint(
+        "transcription", AudioRef(path=audio_path).digest(),
+        speech.backend.parameters(),
+        transcription_settings())
 
 
 def transcribe_audio(audio_path: str, sentence: str) -> dict:
+    """Transcribe audio with the selected backend and return the words with timestamps.
+
+    A transcription is kept in the artifact store, and shared by identical
+    requests in flight at the same time."""
+    key = transcription_key(audio_path)
+    return singleflight.do(
+        "transcription", key, lambda: stored_transcription(key, audio_path, sentence))
+
+
+def stored_transcription(key: str, audio_path: str, sentence: str) -> dict:
+    data = artifacts.get(key)
+    if data is not None:
+        stats["transcription_store.hit"] += 1
+        return json.loads(data)
+    stats["transcription_store.miss"] += 1
+    words = run_transcription(audio_path, sentence)
+    artifacts.put(key, json.dumps(words, ensure_ascii=False).encode("utf-8"))
+    return words
+
+
+def run_transcription(audio_path: str, sentence: str) -> dict:
+    """Transcribe with the backend.
+
+    With downsampling the backend gets a smaller copy of the audio, its
+    timestamps are mapped back onto the original."""
     print(sentence)
-    """Transcribe audio using Whisper and return the transcription with timestamps."""
-    with open(audio_path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            prompt="sentence hint: {sentence}",
-            file=audio_file,
-            model="whisper-1",
-            response_format="verbose_json",
-            timestamp_granularities=["word"]
-        )
-
-        return [
-            {
-                "start": word.start,
-                "end": word.end,
-                "text": word.word
-            }
-            for word in transcription.words
-        ]
+    if not downsample:
+        return speech.backend.transcribe(audio_path, sentence)
+    prepared, offset = prepare_audio(audio_path)
+    try:
+        words = speech.backend.transcribe(prepared.path, sentence)
+    finally:
+        prepared.release()
+    return [
+        dict(word,
+             start=None if word.get("start") is None else word["start"] + offset,
+             end=None if word.get("end") is None else word["end"] + offset)
+        for word in words
+    ]
 
 
-def find_japanese_sentence(japanese_sentence: str, transcription: dict) -> CutRange:
-    system_content = dedent(f"""
-        match the given japanese sentence against the provided transcription
-        return range where japanese sentence begins and ends in transcription
+FIND_JAPANESE_SENTENCE = compile_prompt("find_japanese_sentence", """
+    match the given japanese sentence against the provided transcription
+    return range where japanese sentence begins and ends in transcription
+
+""", render_json_examples("examples"))
+
 
-        examples: {dump_data(examples.find_japanese_sentence)}
-    """)
+def find_japanese_sentence(japanese_sentence: str, transcription: dict) -> CutRange:
+    cut_range, confidence = align_sentence(japanese_sentence, transcription)
+    if cut_range is not None and confidence >= align_threshold:
+        stats["find_japanese_sentence.hit"] += 1
+        if dump_inout:
+            out = dict(
+                input=dict(japanese_sentence=japanese_sentence),
+                output=cut_range.model_dump(),
+                confidence=confidence)
+            print()
+            print(fmt_data(out))
+        return cut_range
+    stats["find_japanese_sentence.miss"] += 1
 
     user_content = dict(
         japanese_sentence=japanese_sentence,
         transcription=transcription
     )
 
-    completion = client.beta.chat.completions.parse(
-        model=model2,
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": dump_data(user_content)}
-        ],
+    completion = chat_cascade(
+        "find_japanese_sentence",
+        lambda cut_range: check_cut_range(cut_range, transcription),
+        messages=FIND_JAPANESE_SENTENCE.messages(
+            japanese_sentence, dump_data(user_content)),
         response_format=CutRange
     )
 
@@ -65,14 +188,25 @@ def find_japanese_sentence(japanese_sentence: str, transcription: dict) -> CutRa
     return response
 
 
-def cut_audio(audio_path: str, cut_range: CutRange) -> bytearray:
-    """Cut the audio file to the specified start and end times and return the resulting bytearray."""
+def cut_audio(audio_path: str, cut_range: CutRange) -> AudioRef:
+    """Cut the audio file to the specified start and end times into a temporary file.
+
+    The cut is kept in the artifact store by the audio content and the range."""
     output_path = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False).name
 
     # Ensure non-negative start time
     padded_start = max(cut_range.begin - 0.5, 0)
     padded_end = cut_range.end + 0.5
 
+    key = fingerprint("cut", AudioRef(path=audio_path).digest(), padded_start, padded_end)
+    data = artifacts.get(key)
+    if data is not None:
+        stats["cut_store.hit"] += 1
+        with open(output_path, "wb") as output_file:
+            output_file.write(data)
+        return AudioRef(path=output_path, temporary=True)
+    stats["cut_store.miss"] += 1
+
     command = [
         "ffmpeg", "-i", audio_path,
         "-ss", str(padded_start), "-to", str(padded_end),
@@ -81,17 +215,19 @@ def cut_audio(audio_path: str, cut_range: CutRange) -> bytearray:
 
     subprocess.run(command, check=True)
 
-    with open(output_path, "rb") as output_file:
-        return bytearray(output_file.read())
+    cut = AudioRef(path=output_path, temporary=True)
+    artifacts.put(key, cut.read())
+    return cut
+
+
+def find_cut_range(japanese_sentence: str, audio: AudioRef) -> CutRange:
+    """Find where the Japanese sentence is spoken in the audio."""
+    transcription = transcribe_audio(audio.path, japanese_sentence)
+    return find_japanese_sentence(
+        japanese_sentence, transcription)
 
 
-def extract_relevant_audio(japanese_sentence: str, audio_bytes: bytearray) -> bytearray:
+def extract_relevant_audio(japanese_sentence: str, audio: AudioRef) -> AudioRef:
     """Extract the relevant part of the audio containing the Japanese sentence."""
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio_file:
-        temp_audio_file.write(audio_bytes)
-        temp_audio_path = temp_audio_file.name
-
-        transcription = transcribe_audio(temp_audio_path, japanese_sentence)
-        cut_range = find_japanese_sentence(
-            japanese_sentence, transcription)
-        return cut_audio(temp_audio_path, cut_range)
+    cut_range = find_cut_range(japanese_sentence, audio)
+    return cut_audio(audio.path, cut_range)
@@ -0,0 +1,42 @@
+import threading
+from common import stats
+
+# bytes of audio the notes in flight may hold at once, None for no limit
+limit = None
+# copies of its source audio a note holds at worst: the fetched source and
+# the upload buffer of the transcription request; the cut is much smaller
+copies = 2
+
+
+class ByteBudget:
+    """Bytes of audio held by notes in flight, bounded by limit.
+
+    A note that does not fit waits until others release theirs; a note
+    larger than the whole budget is admitted once nothing else is held."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.in_use = 0
+        self.peak = 0
+
+    def acquire(self, size) -> int:
+        """Hold size bytes for a note, return the charge to release later."""
+        charge = size * copies
+        with self.condition:
+            if limit is not None and self.in_use and self.in_use + charge > limit:
+                stats["audio.budget_waits"] += 1
+            while limit is not None and self.in_use and self.in_use + charge > limit:
+                self.condition.wait()
+            self.in_use += charge
+            self.peak = max(self.peak, self.in_use)
+            # the estimated charge, not measured memory
+            stats["audio.peak_budget_bytes"] = self.peak
+        return charge
+
+    def release(self, charge):
+        with self.condition:
+            self.in_use -= charge
+            self.condition.notify_all()
+
+
+budget = ByteBudget()
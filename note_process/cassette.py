@@ -0,0 +1,64 @@
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+# "record" appends every call to the cassette file, "replay" answers every
+# call from it; None passes calls through untouched
+mode = None
+path = None
+# "original" replays with the recorded latency, "zero" without any
+latency = "original"
+
+lock = threading.Lock()
+recorded = None
+
+
+def request_key(kind, request) -> str:
+    data = json.dumps([kind, request], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def load():
+    """Read the cassette into per-request queues, in recording order."""
+    global recorded
+    recorded = defaultdict(deque)
+    with open(path, encoding="utf-8") as cassette_file:
+        for line in cassette_file:
+            entry = json.loads(line)
+            recorded[entry["key"]].append(entry)
+
+
+def wrap(kind, describe, call, dump, restore):
+    """Run an upstream call through the cassette.
+
+    describe() returns the JSON-able request that identifies the call, dump
+    turns the response into JSON data and restore turns it back."""
+    if mode is None:
+        return call()
+
+    request = describe()
+    key = request_key(kind, request)
+
+    if mode == "replay":
+        with lock:
+            if recorded is None:
+                load()
+            entries = recorded.get(key)
+            if not entries:
+                raise KeyError(f"No cassette entry for {kind} request {key[:12]}.")
+            entry = entries.popleft()
+        if latency == "original":
+            time.sleep(entry["elapsed"])
+        return restore(entry["response"])
+
+    start = time.perf_counter()
+    response = call()
+    elapsed = time.perf_counter() - start
+    entry = dict(kind=kind, key=key, request=request,
+                 response=dump(response), elapsed=elapsed)
+    with lock:
+        with open(path, "a", encoding="utf-8") as cassette_file:
+            cassette_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return response
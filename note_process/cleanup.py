@@ -1,26 +1,31 @@
+import os
+import re
 import json
-import requests
-import base64
-import uuid
+import time
+import queue
 import argparse
+import cProfile
+import multiprocessing
 import traceback
+import common
 import examples
 from process import *
-
-ANKICONNECT_URL = "http://127.0.0.1:8765"
-
-
-def invoke(action, **params):
-    """Helper function to interact with AnkiConnect."""
-    return requests.post(
-        ANKICONNECT_URL, json={"action": action,
-                               "version": 6, "params": params}
-    ).json()
-
-
-def get_note_ids_with_tag(tag):
+from ankiconnect import *
+import media
+import hedging
+import ratelimit
+import workqueue
+import fingerprints
+import artifacts
+import pipeline
+import audiobudget
+import singleflight
+import audio as audio_stage
+
+
+def get_note_ids_with_tag(tag, query=""):
     """Retrieve note IDs for notes with a specific tag and of type 'Mining'."""
-    response = invoke("findNotes", query=f"-tag:{tag} note:Mining")
+    response = invoke("findNotes", query=f"-tag:{tag} note:Mining {query}".strip())
     if response.get("error") is not None:
         raise ValueError(f"AnkiConnect error: {response['error']}")
     return response.get("result", [])
@@ -46,17 +51,8 @@ def get_note(note_id):
 
 
 def fetch_audio_data(file_name):
-    """Fetch audio data from the collection media folder."""
-    response = invoke("retrieveMediaFile", filename=file_name)
-    if response.get("error") is not None:
-        raise ValueError(f"AnkiConnect error fetching audio: {
-                         response['error']}")
-
-    audio_data = response.get("result")
-    if audio_data is None:
-        raise ValueError(f"Audio file {file_name} not found.")
-
-    return bytearray(base64.b64decode(audio_data))
+    """Reference audio data in the collection media folder."""
+    return media.read_media_file(file_name)
 
 
 def extract_audio_filename(audio_field):
@@ -66,11 +62,14 @@ def extract_audio_filename(audio_field):
     return ""
 
 
-def prepare_input(note):
+def raw_audio_filename(note):
+    return extract_audio_filename(note["fields"].get("Raw Sentence Audio", {}).get("value", ""))
+
+
+def prepare_input(note, with_audio=True):
     """Prepare the input structure for the process function based on the field mapping."""
-    audio_field = note["fields"].get("Raw Sentence Audio", {}).get("value", "")
-    audio_file = extract_audio_filename(audio_field)
-    audio_data = fetch_audio_data(audio_file) if audio_file else bytearray()
+    audio_file = raw_audio_filename(note)
+    audio = fetch_audio_data(audio_file) if audio_file and with_audio else None
 
     input_structure = Input(
         vocabulary=note["fields"].get(
@@ -80,24 +79,37 @@ def prepare_input(note):
             "Raw Sentence Japanese", {}).get("value", ""),
         subtitle_english=note["fields"].get(
             "Raw Sentence English", {}).get("value", ""),
-        audio=audio_data
+        audio=audio
     )
     return input_structure
 
 
+HIGHLIGHT_OPEN = "<span class=\"expression-highlight\">"
+
+
 def merge_triplet(triplet):
     """Merge the prefix, middle, and suffix into the required HTML format."""
-    return f"{triplet.prefix}<span class=\"expression-highlight\">{triplet.middle}</span>{triplet.suffix}"
+    return f"{triplet.prefix}{HIGHLIGHT_OPEN}{triplet.middle}</span>{triplet.suffix}"
 
 
-def upload_audio_to_anki(audio_data):
-    """Upload audio file to Anki's media collection with a random file name."""
-    file_name = f"sentence_audio_{uuid.uuid4().hex}.mp3"
-    response = invoke("storeMediaFile", filename=file_name,
-                      data=base64.b64encode(audio_data).decode("utf-8"))
-    if response.get("error") is not None:
-        raise ValueError(f"AnkiConnect error uploading audio: {
-                         response['error']}")
+def parse_triplet(field):
+    """Split a merged field back into its triplet, None if it has no highlight."""
+    prefix, found, rest = field.partition(HIGHLIGHT_OPEN)
+    middle, closed, suffix = rest.partition("</span>")
+    if not found or not closed:
+        return None
+    return Triplet(prefix=prefix, middle=middle, suffix=suffix)
+
+
+def upload_audio_to_anki(audio):
+    """Upload audio file to Anki's media collection under its content hash.
+
+    Identical cuts share one file, which is only uploaded once."""
+    file_name = f"sentence_audio_{audio.digest()[:32]}.mp3"
+    if media.media_file_exists(file_name):
+        stats["upload_audio.skipped"] += 1
+    else:
+        media.store_media_file(file_name, audio)
     return file_name
 
 
@@ -105,13 +117,15 @@ def update_note_fields(note_id, results):
     """Update the output fields in the note with the processed results."""
     audio_file_name = upload_audio_to_anki(results.sentence_audio)
 
-    fields_to_update = {
+    set_note_fields(note_id, {
         "Sentence Japanese": merge_triplet(results.sentence_japanese),
         "Sentence Furigana": merge_triplet(results.sentence_furigana),
         "Sentence English": merge_triplet(results.sentence_english),
         "Sentence Audio": f"[sound:{audio_file_name}]"
-    }
+    })
+
 
+def set_note_fields(note_id, fields_to_update):
     response = invoke("updateNoteFields", note={
         "id": note_id,
         "fields": fields_to_update
@@ -122,25 +136,381 @@ def update_note_fields(note_id, results):
                          response['error']}")
 
 
-def process_note_by_id(note_id):
+def admit_audio(audio, size=None) -> int:
+    """Hold the in-flight audio budget for a note, waiting until it fits."""
+    if size is None:
+        size = audio.size() if audio is not None else 0
+    return audiobudget.budget.acquire(size)
+
+
+def process_note_by_id(note_id, owned=None):
+    """Process a single note by ID, within the time budget of a note.
+
+    owned() is asked before the fields are written, a note that is not
+    owned anymore is left to whoever owns it now. Errors are reported and
+    returned, None means the note was processed."""
     try:
-        """Process a single note by ID."""
-        note = get_note(note_id)
-        input_structure = prepare_input(note)
-        result = process(input_structure)
-        update_note_fields(note_id, result)
+        with hedging.time_budget(hedging.note_budget):
+            note = get_note(note_id)
+            input_structure = prepare_input(note)
+            result = None
+            charge = admit_audio(input_structure.audio)
+            try:
+                result = process(input_structure)
+                if owned is not None and not owned():
+                    raise ValueError("the note was handed to another worker, its fields are not written")
+                update_note_fields(note_id, result)
+                fingerprints.store(note_id, stage_fingerprints(
+                    input_structure, raw_audio_filename(note)))
+            finally:
+                if input_structure.audio is not None:
+                    input_structure.audio.release()
+                if result is not None:
+                    result.sentence_audio.release()
+                audiobudget.budget.release(charge)
         add_tag_to_note(note_id, "generated-0")
         print(f"Note {note_id} processed and tagged successfully.")
     except Exception as e:
         print(f"Error processing note {note_id}: {e}")
         print(traceback.format_exc())
+        return e
 
 
-def process_unprocessed_notes():
+def process_unprocessed_notes(stream=False, llm_workers=4):
     """Process notes of type 'Mining' that do not have the 'generated-0' tag."""
     note_ids = get_note_ids_with_tag("generated-0")
-    for note_id in note_ids:
-        process_note_by_id(note_id)
+    if stream:
+        process_notes_streaming(note_ids, llm_workers)
+    else:
+        for note_id in note_ids:
+            process_note_by_id(note_id)
+    print_stats()
+
+
+class NoteJob:
+    """A note on its way through the streaming pipeline."""
+
+    def __init__(self, note):
+        self.note = note
+        self.note_id = note["noteId"]
+        self.deadline = None if hedging.note_budget is None else time.monotonic() + hedging.note_budget
+        self.input = None
+        self.extracted = None
+        self.split_out = None
+        self.cut_range = None
+        self.cut = None
+        self.charge = 0
+
+    def time_budget(self):
+        """The rest of the time budget of the note, for the stage it is in."""
+        return hedging.time_budget(
+            None if self.deadline is None else max(self.deadline - time.monotonic(), 0))
+
+    def release(self):
+        for audio in (self.input and self.input.audio, self.cut):
+            if audio is not None:
+                audio.release()
+        audiobudget.budget.release(self.charge)
+        self.charge = 0
+
+
+def prefetch_notes(note_ids, batch_size):
+    """Yield jobs with note info and source audio, fetching batch_size notes per call.
+
+    Jobs are admitted within the in-flight audio budget."""
+    for begin in range(0, len(note_ids), batch_size):
+        response = invoke("notesInfo", notes=note_ids[begin:begin + batch_size])
+        if response.get("error") is not None:
+            raise ValueError(f"AnkiConnect error: {response['error']}")
+        for note in response["result"]:
+            job = NoteJob(note)
+            try:
+                # a note is only fetched once its audio fits the budget; when
+                # the size is unknown up front, the next fetch waits instead
+                audio_file = raw_audio_filename(note)
+                size = media.media_file_size(audio_file) if audio_file else 0
+                if size is not None:
+                    job.charge = admit_audio(None, size)
+                job.input = prepare_input(note)
+                if size is None:
+                    job.charge = admit_audio(job.input.audio)
+            except Exception as e:
+                report_failed_job(job, e)
+                continue
+            yield job
+
+
+def process_job_text(job):
+    """Model stages of a job: the sentences and where they are spoken."""
+    with job.time_budget():
+        job.extracted, job.split_out = process_text(job.input)
+        job.cut_range = find_cut_range(job.extracted.sentence_japanese, job.input.audio)
+    return job
+
+
+def cut_job_audio(job):
+    with job.time_budget():
+        job.cut = cut_audio(job.input.audio.path, job.cut_range)
+    job.input.audio.release()
+    return job
+
+
+def write_back(jobs):
+    """Store the audio and write the fields of several notes with one multi call."""
+    actions = []
+    uploaded = []
+    for job in jobs:
+        sentence_japanese, sentence_furigana, sentence_english = job.split_out
+        try:
+            audio_file_name = upload_audio_to_anki(job.cut)
+        except Exception as e:
+            # one note whose audio cannot be stored must not fail the batch
+            report_failed_job(job, e)
+            continue
+        uploaded.append(job)
+        # sub-actions without a version get unwrapped version 4 results
+        actions.append(dict(action="updateNoteFields", version=6, params=dict(note=dict(
+            id=job.note_id,
+            fields={
+                "Sentence Japanese": merge_triplet(sentence_japanese),
+                "Sentence Furigana": merge_triplet(sentence_furigana),
+                "Sentence English": merge_triplet(sentence_english),
+                "Sentence Audio": f"[sound:{audio_file_name}]",
+            }))))
+    if not actions:
+        return
+    response = invoke("multi", actions=actions)
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error: {response['error']}")
+
+    written = []
+    for job, result in zip(uploaded, response["result"]):
+        if result.get("error") is not None:
+            report_failed_job(job, ValueError(f"AnkiConnect error updating fields: {result['error']}"))
+            continue
+        fingerprints.store(job.note_id, stage_fingerprints(
+            job.input, raw_audio_filename(job.note)))
+        written.append(job)
+    if written:
+        response = invoke("addTags", notes=[job.note_id for job in written], tags="generated-0")
+        if response.get("error") is not None:
+            raise ValueError(f"AnkiConnect error adding tag: {response['error']}")
+    for job in written:
+        job.release()
+        print(f"Note {job.note_id} processed and tagged successfully.")
+
+
+def report_failed_job(job, error):
+    print(f"Error processing note {job.note_id}: {error}")
+    print("".join(traceback.format_exception(error)))
+    job.release()
+
+
+def process_notes_streaming(note_ids, llm_workers=4, cut_workers=None, batch_size=20):
+    """Process notes in a pipeline of stages connected by bounded queues.
+
+    A prefetcher reads notes and their audio ahead, llm_workers run the
+    model stages, cut_workers (one per core by default) run ffmpeg and a
+    batcher writes the results back. Each queue holds at most twice the
+    workers that read from it, so a slow stage holds back the ones before it."""
+    cut_workers = cut_workers or os.cpu_count() or 1
+    fetched = queue.Queue(2 * llm_workers)
+    located = queue.Queue(2 * cut_workers)
+    cut = queue.Queue(2 * batch_size)
+    stages = [
+        pipeline.Stage("llm", process_job_text, fetched, located, llm_workers, report_failed_job),
+        pipeline.Stage("cut", cut_job_audio, located, cut, cut_workers, report_failed_job),
+        pipeline.Batcher("write", write_back, cut, batch_size, on_error=report_failed_job),
+    ]
+    elapsed = pipeline.run(prefetch_notes(note_ids, batch_size), stages)
+    print(f"{len(note_ids)} notes in {elapsed:.1f}s")
+
+
+def refresh_note(note):
+    """Recompute only the stages of a note whose fingerprint changed.
+
+    Returns the stages that were stale. A stale extraction, or fields that
+    cannot be read back, means the whole note is processed again."""
+    note_id = note["noteId"]
+    input_structure = prepare_input(note, with_audio=False)
+    normalize_input(input_structure)
+    current = stage_fingerprints(input_structure, raw_audio_filename(note))
+    stored = fingerprints.load(note_id)
+    stale = [stage for stage in current if stored.get(stage) != current[stage]]
+    if not stale:
+        return stale
+
+    fields = note["fields"]
+    split_out = [
+        parse_triplet(fields.get(name, {}).get("value", ""))
+        for name in ("Sentence Japanese", "Sentence Furigana", "Sentence English")
+    ]
+    if "extract" in stale or None in split_out:
+        error = process_note_by_id(note_id)
+        if error is not None:
+            raise error
+        return list(current)
+
+    with hedging.time_budget(hedging.note_budget):
+        sentences = [join_triplet(triplet) for triplet in split_out]
+        updates = {}
+        if "furigana" in stale:
+            sentences[1] = augment_furigana(sentences[0])
+            split_out[1] = None
+        if "split" in stale:
+            split_out = [None, None, None]
+        if None in split_out:
+            split_out = split_stage(input_structure.vocabulary, sentences, split_out)
+            for name, triplet in zip(
+                    ("Sentence Japanese", "Sentence Furigana", "Sentence English"), split_out):
+                if merge_triplet(triplet) != fields[name]["value"]:
+                    updates[name] = merge_triplet(triplet)
+        if "audio" in stale:
+            audio = fetch_audio_data(raw_audio_filename(note))
+            cut = None
+            try:
+                cut = extract_relevant_audio(sentences[0], audio)
+                updates["Sentence Audio"] = f"[sound:{upload_audio_to_anki(cut)}]"
+            finally:
+                audio.release()
+                if cut is not None:
+                    cut.release()
+        if updates:
+            set_note_fields(note_id, updates)
+    fingerprints.store(note_id, current)
+    return stale
+
+
+def refresh_stale_notes():
+    """Recompute the outdated stages of every processed Mining note."""
+    response = invoke("findNotes", query="tag:generated-0 note:Mining")
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error: {response['error']}")
+    note_ids = response.get("result", [])
+
+    refreshed = Counter()
+    for begin in range(0, len(note_ids), 500):
+        response = invoke("notesInfo", notes=note_ids[begin:begin + 500])
+        if response.get("error") is not None:
+            raise ValueError(f"AnkiConnect error: {response['error']}")
+        for note in response["result"]:
+            try:
+                stale = refresh_note(note)
+            except Exception as e:
+                print(f"Error refreshing note {note['noteId']}: {e}")
+                print(traceback.format_exc())
+                continue
+            if stale:
+                print(f"Note {note['noteId']} refreshed: {', '.join(stale)}")
+            refreshed.update(stale)
+    print(f"{len(note_ids)} notes checked, stale stages: {dict(refreshed)}")
+    print_stats()
+
+
+def work_queue(queue_path):
+    """Process the notes claimed from the work queue until it is empty."""
+    queue = workqueue.WorkQueue(queue_path)
+    while True:
+        note_id = queue.claim()
+        if note_id is None:
+            break
+        with queue.held(note_id):
+            error = process_note_by_id(note_id, lambda: queue.renew(note_id))
+        queue.finish(note_id, None if error is None else f"{type(error).__name__}: {error}")
+    print_stats()
+
+
+def run_worker(args):
+    """Entry point of a worker process, it applies the options of the parent itself."""
+    configure(args)
+    work_queue(args.queue)
+
+
+def process_queued_notes(args):
+    """Queue the unprocessed notes and process them with args.workers worker processes."""
+    queue = workqueue.WorkQueue(args.queue)
+    added = queue.enqueue(get_note_ids_with_tag("generated-0"))
+    print(f"{added} notes queued, {queue.counts()}")
+    processes = [
+        # spawned, not forked: a worker must not share the open connections of the parent
+        multiprocessing.get_context("spawn").Process(target=run_worker, args=(args,))
+        for _ in range(args.workers)
+    ]
+    for worker in processes:
+        worker.start()
+    for worker in processes:
+        worker.join()
+    print_queue_status(args.queue)
+
+
+def print_queue_status(queue_path):
+    queue = workqueue.WorkQueue(queue_path)
+    print(f"queue: {queue.counts()}")
+    for note_id, attempts, error in queue.dead_letters():
+        print(f"dead note {note_id} after {attempts} attempts: {error}")
+
+
+def watch_notes(interval):
+    """Process Mining notes as they are added, until interrupted.
+
+    All unprocessed notes are processed once, then the notes added today
+    are polled every interval seconds. A note is tried once per session,
+    a failed one is left for the next --process-unprocessed run. A failed
+    poll is retried after interval seconds."""
+    seen = set()
+    query = ""
+    try:
+        while True:
+            try:
+                note_ids = get_note_ids_with_tag("generated-0", query)
+            except Exception as e:
+                # Anki closed or busy, poll again later
+                print(f"Error polling notes: {e}")
+                time.sleep(interval)
+                continue
+            # notes that left the query cannot come back, forget them
+            seen &= set(note_ids)
+            for note_id in note_ids:
+                if note_id not in seen:
+                    seen.add(note_id)
+                    try:
+                        process_note_by_id(note_id)
+                    except Exception as e:
+                        print(f"Error processing note {note_id}: {e}")
+                        print(traceback.format_exc())
+            query = "added:1"
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print_stats()
+
+
+def collect_garbage(dry_run=False):
+    """Delete sentence audio files that no note references anymore."""
+    # list files before notes, so clips uploaded meanwhile are never deleted
+    file_names = set(media.list_media_files("sentence_audio_*"))
+
+    # every note is scanned, a deleted clip cannot be recovered by a rerun
+    response = invoke("findNotes", query="deck:*")
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error: {response['error']}")
+    note_ids = response.get("result", [])
+
+    referenced = set()
+    for begin in range(0, len(note_ids), 500):
+        response = invoke("notesInfo", notes=note_ids[begin:begin + 500])
+        if response.get("error") is not None:
+            raise ValueError(f"AnkiConnect error: {response['error']}")
+        for note in response["result"]:
+            for field in note["fields"].values():
+                referenced.update(re.findall(
+                    r"\[sound:(sentence_audio_[^\]]+)\]", field["value"]))
+
+    orphans = sorted(file_names - referenced)
+    for file_name in orphans:
+        print(f"{'Would delete' if dry_run else 'Deleting'} {file_name}")
+        if not dry_run:
+            media.delete_media_file(file_name)
+    print(f"{len(orphans)} of {len(file_names)} sentence audio files unreferenced.")
 
 
 def main():
@@ -150,15 +520,172 @@ def main():
                         help="Reprocess a single note by its ID.")
     parser.add_argument("--process-unprocessed", action="store_true",
                         help="Process all unprocessed notes.")
+    parser.add_argument("--refresh-stale", action="store_true",
+                        help="Recompute only the stages of processed notes whose fingerprint changed.")
+    parser.add_argument("--fingerprints", default=fingerprints.path,
+                        help="Index of the stage fingerprints of processed notes.")
+    parser.add_argument("--artifacts", default=artifacts.path,
+                        help="Directory of stored transcriptions and audio cuts.")
+    parser.add_argument("--artifacts-mb", type=float, default=artifacts.max_bytes / (1 << 20),
+                        help="Size limit of the stored artifacts in MB, 0 to store none.")
+    parser.add_argument("--stream", action="store_true",
+                        help="With --process-unprocessed, run fetch, model, ffmpeg and write-back as concurrent stages.")
+    parser.add_argument("--llm-workers", type=int, default=4,
+                        help="Notes in the model stages at once with --stream.")
+    parser.add_argument("--audio-budget", type=float,
+                        help="Megabytes of audio the notes in flight may hold at once.")
+    parser.add_argument("--no-downsample", action="store_true",
+                        help="Upload the source audio as it is for transcription.")
+    parser.add_argument("--trim-silence", action="store_true",
+                        help="Cut leading and trailing silence before transcription.")
+    parser.add_argument("--batch-transcriptions", type=int, metavar="CLIPS",
+                        help="With --stream, transcribe up to this many short clips in one request.")
+    parser.add_argument("--no-dedupe", action="store_true",
+                        help="Do not share identical requests of notes in flight at the same time.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and process Mining notes as they are added.")
+    parser.add_argument("--poll-interval", type=float, default=5.0,
+                        help="Seconds between checks for new notes with --watch.")
+    parser.add_argument("--queue",
+                        help="SQLite work queue shared by workers; with --process-unprocessed, queue the notes and run --workers.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for --process-unprocessed with --queue.")
+    parser.add_argument("--work", action="store_true",
+                        help="Process notes from --queue until it is empty, as an additional worker.")
+    parser.add_argument("--max-attempts", type=int, default=workqueue.max_attempts,
+                        help="Failed attempts before a queued note becomes a dead letter.")
+    parser.add_argument("--queue-status", action="store_true",
+                        help="Print the state counts and dead letters of --queue.")
+    parser.add_argument("--retry-dead", action="store_true",
+                        help="Queue the dead letters of --queue again.")
+    parser.add_argument("--models", nargs="+",
+                        help="Model cascade for every stage, cheapest first.")
+    parser.add_argument("--repair-attempts", type=int, default=common.repair_attempts,
+                        help="How often invalid model output is sent back for repair.")
+    parser.add_argument("--fuse-extract-split", action="store_true",
+                        help="Extract and split the sentences in one model call.")
+    parser.add_argument("--deadline", type=float, default=hedging.default_deadline,
+                        help="Seconds a chat completion may take before it is abandoned.")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Send a duplicate request when a call runs past the p95 latency of its stage.")
+    parser.add_argument("--hedge-budget", type=float, default=hedging.budget,
+                        help="Duplicate requests at most, as a fraction of all requests.")
+    parser.add_argument("--note-budget", type=float,
+                        help="Seconds one note may take before it is given up.")
+    parser.add_argument("--chat-limits", type=float, nargs=2, metavar=("RPM", "TPM"),
+                        help="Chat requests and tokens per minute, read from the rate limit headers by default.")
+    parser.add_argument("--transcription-rpm", type=float,
+                        help="Transcription requests per minute, read from the rate limit headers by default.")
+    parser.add_argument("--rate-utilization", type=float, default=ratelimit.utilization,
+                        help="Fraction of the rate limits to use.")
+    parser.add_argument("--gc-media", action="store_true",
+                        help="Delete sentence audio files no note references.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="With --gc-media, only list what would be deleted.")
+    parser.add_argument("--media-mode", choices=media.MEDIA_MODES,
+                        help="Access media directly, by path or as base64 (detected by default, base64 with --record or --replay).")
+    parser.add_argument("--cassette",
+                        help="Cassette file for --record or --replay, replay with the options used to record.")
+    parser.add_argument("--record", action="store_true",
+                        help="Record OpenAI and AnkiConnect traffic into the cassette.")
+    parser.add_argument("--replay", action="store_true",
+                        help="Answer OpenAI and AnkiConnect calls from the cassette.")
+    parser.add_argument("--replay-latency", choices=["original", "zero"],
+                        default="original",
+                        help="Replay with the recorded latency or without any.")
+    parser.add_argument("--profile",
+                        help="Write cProfile statistics of the run to this file.")
+    parser.add_argument("--transcription-backend", choices=speech.backends,
+                        default="openai",
+                        help="Transcribe with the hosted API or a local CPU model.")
+    parser.add_argument("--whisper-model", default="small",
+                        help="Model size for the local transcription backend.")
     args = parser.parse_args()
 
+    if (args.record or args.replay) and not args.cassette:
+        parser.error("--record and --replay need --cassette")
+    if (args.record or args.replay) and args.media_mode not in (None, "base64"):
+        # direct access skips the cassette and paths of temporary files never replay
+        parser.error("--record and --replay send media as base64, not with --media-mode "
+                     + args.media_mode)
+    if (args.work or args.queue_status or args.retry_dead) and not args.queue:
+        parser.error("--work, --queue-status and --retry-dead need --queue")
+    configure(args)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     if args.reprocess:
         process_note_by_id(args.reprocess)
+    elif args.process_unprocessed and args.queue:
+        process_queued_notes(args)
     elif args.process_unprocessed:
-        process_unprocessed_notes()
+        process_unprocessed_notes(args.stream, args.llm_workers)
+    elif args.work:
+        work_queue(args.queue)
+    elif args.queue_status or args.retry_dead:
+        if args.retry_dead:
+            print(f"{workqueue.WorkQueue(args.queue).retry_dead()} dead notes pending again")
+        print_queue_status(args.queue)
+    elif args.refresh_stale:
+        refresh_stale_notes()
+    elif args.watch:
+        watch_notes(args.poll_interval)
+    elif args.gc_media:
+        collect_garbage(args.dry_run)
     else:
         print("No valid arguments provided. Use --help for options.")
 
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+
+def configure(args):
+    """Apply the command line options to the modules they configure."""
+    common.fuse_extract_split = args.fuse_extract_split
+    common.repair_attempts = args.repair_attempts
+    hedging.default_deadline = args.deadline
+    hedging.enabled = args.hedge
+    hedging.budget = args.hedge_budget
+    hedging.note_budget = args.note_budget
+    ratelimit.utilization = args.rate_utilization
+    if args.chat_limits:
+        ratelimit.configure("chat", *args.chat_limits)
+    if args.transcription_rpm:
+        ratelimit.configure("transcription", args.transcription_rpm)
+    if args.models:
+        for stage in common.cascades:
+            common.cascades[stage] = args.models
+    if args.media_mode:
+        media.media_mode = args.media_mode
+    if args.transcription_backend == "local":
+        speech.use_backend("local", model_size=args.whisper_model)
+    if args.batch_transcriptions and args.stream:
+        # only the streaming pipeline transcribes notes concurrently
+        speech.use_batching(max_clips=args.batch_transcriptions)
+
+    if args.record or args.replay:
+        cassette.mode = "record" if args.record else "replay"
+        cassette.path = args.cassette
+        cassette.latency = args.replay_latency
+        # media goes through the API, so a replay needs neither the media
+        # folder nor the temporary files of the recording
+        media.media_mode = "base64"
+    singleflight.enabled = not args.no_dedupe
+    workqueue.max_attempts = args.max_attempts
+    fingerprints.path = args.fingerprints
+    artifacts.path = args.artifacts
+    artifacts.max_bytes = int(args.artifacts_mb * (1 << 20))
+    audio_stage.downsample = not args.no_downsample
+    audio_stage.trim_silence = args.trim_silence
+    if args.audio_budget:
+        audiobudget.limit = int(args.audio_budget * (1 << 20))
+    if args.note_budget:
+        # a lease has to outlast the note it covers
+        workqueue.lease_seconds = max(workqueue.lease_seconds, 2 * args.note_budget)
+
 
 if __name__ == "__main__":
     main()
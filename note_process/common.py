@@ -1,13 +1,81 @@
+import os
+import hashlib
 import textwrap
 import json
+from collections import Counter
 from openai import OpenAI
+from openai.types.chat import ParsedChatCompletion
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import cassette
+import hedging
+import ratelimit
 
 model = "gpt-4o-mini"
 dump_inout = True
+# models tried in order per stage; a stage escalates to the next model when
+# the output fails local validation, stages not listed only use `model`
+cascades = dict(
+    extract_sentences=[model, "gpt-4o"],
+    extract_split_sentences=[model, "gpt-4o"],
+    augment_furigana=[model, "gpt-4o"],
+    split_sentences=[model, "gpt-4o"],
+    find_japanese_sentence=[model, "gpt-4o"],
+)
+# how often invalid output is sent back to be repaired before a stage fails
+repair_attempts = 1
+# extract the sentences already split around the vocabulary in one call
+fuse_extract_split = False
 
-client = OpenAI()
+# ratelimit.run retries, retries of the client would hide 429s from its buckets
+client = OpenAI(max_retries=0)
+
+# run counters, keys are "<stage>.<event>"; "<stage>.hit"/"<stage>.miss" pairs
+# are reported as hit rates
+stats = Counter()
+
+
+class InvalidResponse(Exception):
+    """Model output that failed local validation.
+
+    errors maps the index of every failed item to its message, for stages
+    that answer a list of items."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or {}
+
+
+class AudioRef(BaseModel):
+    """Audio kept on disk, the bytes are only read by whoever needs them."""
+    path: str
+    temporary: bool = False
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def read(self) -> bytes:
+        with self.open() as audio_file:
+            return audio_file.read()
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def digest(self) -> str:
+        """Hex sha256 of the content, read in blocks."""
+        sha = hashlib.sha256()
+        with self.open() as audio_file:
+            for block in iter(lambda: audio_file.read(1 << 16), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def release(self):
+        """Delete the file if it was created for this note only."""
+        if self.temporary:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
 
 
 class Input(BaseModel):
@@ -15,7 +83,12 @@ class Input(BaseModel):
     guide: str
     subtitle_japanese: str
     subtitle_english: str
-    audio: bytes
+    audio: Optional[AudioRef] = None
+
+
+class Extracted(BaseModel):
+    sentence_japanese: str
+    sentence_english: str
 
 
 class Triplet(BaseModel):
@@ -24,11 +97,96 @@ class Triplet(BaseModel):
     suffix: str
 
 
+class CutRange(BaseModel):
+    begin: float
+    end: float
+
+
+class ExtractedSplit(BaseModel):
+    sentence_japanese: Triplet
+    sentence_english: Triplet
+
+
 class Output(BaseModel):
     sentence_japanese: Triplet
     sentence_furigana: Triplet
     sentence_english: Triplet
-    sentence_audio: bytes
+    sentence_audio: AudioRef
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count: about four ascii characters or one other character per token."""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + len(text) - ascii_chars
+
+
+def chat_parse(stage="chat", **request):
+    """Structured-output chat completion, recorded or replayed by the cassette.
+
+    The upstream call is paced by the chat rate limiter and, once it has
+    capacity, runs within the deadline of the stage, hedged when hedging is
+    enabled."""
+    response_format = request["response_format"]
+    tokens = estimate_tokens(dump_data(request["messages"])) + ratelimit.completion_tokens
+    completion = cassette.wrap(
+        "chat",
+        lambda: dict(request, response_format=response_format.model_json_schema()),
+        lambda: ratelimit.run(
+            "chat", tokens,
+            lambda: hedging.run(
+                stage,
+                lambda timeout: client.beta.chat.completions.with_raw_response.parse(
+                    **request, timeout=timeout),
+                stats),
+            stats),
+        lambda completion: completion.model_dump(mode="json"),
+        lambda data: ParsedChatCompletion[response_format].model_validate(data))
+
+    if completion.usage is not None:
+        details = completion.usage.prompt_tokens_details
+        stats["chat.prompt_tokens"] += completion.usage.prompt_tokens
+        stats["chat.cached_tokens"] += (details.cached_tokens or 0) if details else 0
+    return completion
+
+
+def cascade_model(stage, attempt):
+    """Model for the given attempt of a stage, the last tier is kept for further attempts."""
+    models = cascades.get(stage, [model])
+    return models[min(attempt, len(models) - 1)]
+
+
+def chat_cascade(stage, validate, **request):
+    """Run a chat completion through the model cascade of a stage.
+
+    validate(parsed) raises InvalidResponse for unusable output. The stage
+    is then asked again, up to repair_attempts times, with the invalid
+    answer and the error fed back and on the next model of the cascade;
+    the last failure propagates. The error is sent to the model as it is,
+    so validate only raises for what the model broke, such as markup or
+    text that differs from the input, never for a heuristic the input
+    itself may not meet."""
+    messages = list(request.pop("messages"))
+    stats[f"{stage}.calls"] += 1
+    for attempt in range(repair_attempts + 1):
+        tier_model = cascade_model(stage, attempt)
+        completion = chat_parse(stage, model=tier_model, messages=messages, **request)
+        try:
+            validate(completion.choices[0].message.parsed)
+            return completion
+        except InvalidResponse as e:
+            if attempt == repair_attempts:
+                stats[f"{stage}.failed"] += 1
+                raise
+            next_model = cascade_model(stage, attempt + 1)
+            if next_model != tier_model:
+                stats[f"{stage}.escalated"] += 1
+            print(f"{stage}: {tier_model} output invalid ({e}), "
+                  f"asking {next_model} again")
+            messages += [
+                {"role": "assistant", "content": completion.choices[0].message.content},
+                {"role": "user", "content": f"The answer is invalid: {e}. "
+                                            "Answer again, keeping the text of the input as it is."},
+            ]
 
 
 def dedent(string):
@@ -41,3 +199,24 @@ def dump_data(data):
 
 def fmt_data(data):
     return json.dumps(data, indent=4, ensure_ascii=False)
+
+
+def print_stats():
+    """Print the run counters and the hit rate of every stage with a fast path."""
+    if not stats:
+        return
+    print()
+    for key, value in sorted(stats.items()):
+        print(f"{key}: {value}")
+    for key in sorted(stats):
+        if key.endswith(".hit"):
+            stage = key[:-len(".hit")]
+            total = stats[key] + stats[f"{stage}.miss"]
+            print(f"{stage} hit rate: {stats[key] / total:.1%}")
+    for key in sorted(stats):
+        if key.endswith(".calls") and stats[key]:
+            stage = key[:-len(".calls")]
+            print(f"{stage} escalation rate: {stats[f'{stage}.escalated'] / stats[key]:.1%}")
+    if stats["chat.prompt_tokens"]:
+        print(f"cached prompt token ratio: "
+              f"{stats['chat.cached_tokens'] / stats['chat.prompt_tokens']:.1%}")
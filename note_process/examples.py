@@ -1371,3 +1371,47 @@ find_japanese_sentence = [
         }
     }
 ]
+
+
+extract_split_sentences = [
+    {
+        "input": {
+            "vocabulary": "正式",
+            "guide": "‎ＵＡＰの存在を正式に認め",
+            "subtitle_japanese": "‎ねえ ウザいんだけど<br>‎アメリカ軍は<br>‎ＵＡＰの存在を正式に認め<br>‎“宇宙軍”を再編成しました",
+            "subtitle_english": "Hey, you're being a pest.<br>The U.S. military has officially<br>acknowledged the existence of UAPs<br>and reformed the Space Force!"
+        },
+        "output": {
+            "sentence_japanese": {
+                "prefix": "アメリカ軍はＵＡＰの存在を",
+                "middle": "正式",
+                "suffix": "に認め「宇宙軍」を再編成しました。"
+            },
+            "sentence_english": {
+                "prefix": "The U.S. military has ",
+                "middle": "officially",
+                "suffix": " acknowledged the existence of UAPs and reformed the Space Force!"
+            }
+        }
+    },
+    {
+        "input": {
+            "vocabulary": "証明",
+            "guide": "‎さて 証明してやりましょうか",
+            "subtitle_japanese": "‎心霊スポット<br>‎さて 証明してやりましょうか<br>‎<br>‎幽霊なんかいないってことを！",
+            "subtitle_english": "At the spiritual hotspot.<br>Now, I'll go and prove it right now…<br>that there are no such things as ghosts!"
+        },
+        "output": {
+            "sentence_japanese": {
+                "prefix": "さて",
+                "middle": "証明",
+                "suffix": "してやりましょうか幽霊なんかいないってことを！"
+            },
+            "sentence_english": {
+                "prefix": "Now, I'll go and ",
+                "middle": "prove",
+                "suffix": " it right now that there are no such things as ghosts!"
+            }
+        }
+    }
+]
@@ -0,0 +1,125 @@
+import re
+import unicodedata
+import validation
+from common import *
+from typing import Optional
+
+JAPANESE_TERMINAL = "。！？!?…‥"
+JAPANESE_CLOSING = "」』）)”\"'"
+ENGLISH_TERMINAL = ".!?…"
+ENGLISH_CLOSING = "\"'”’)]"
+JAPANESE_QUOTES = str.maketrans({"“": "「", "”": "」", "『": "「", "』": "」"})
+# a sentence runs up to a run of terminal punctuation and its closing marks;
+# an ellipsis does not end a japanese sentence, it often just trails off
+JAPANESE_SENTENCE = re.compile(r".+?(?:[。！？!?]+[」』）)”\"']*|$)")
+# an english sentence only ends where the next one does not start in lowercase
+ENGLISH_SENTENCE = re.compile(r".+?(?:[.!?…]+[\"'”’)\]]*(?=\s+[^\sa-z])|$)")
+ENGLISH_CONTINUED = re.compile(r"(\.\.\.|…)$")
+JAPANESE_SCRIPT = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff]")
+
+
+def is_terminated(line: str, terminal: str, closing: str) -> bool:
+    """Check whether a subtitle line ends a sentence."""
+    line = line.rstrip().rstrip(closing)
+    return bool(line) and line[-1] in terminal
+
+
+def subtitle_lines(subtitle: str) -> list:
+    """Non-empty lines of a subtitle, without control and direction marks."""
+    lines = subtitle.replace("<br>", "\n").split("\n")
+    lines = ["".join(ch for ch in line if unicodedata.category(ch)[0] != "C") for line in lines]
+    return [line.strip() for line in lines if line.strip()]
+
+
+def clean_japanese(sentence: str) -> str:
+    sentence = "".join(ch for ch in sentence if unicodedata.category(ch)[0] != "C")
+    return re.sub(r"\s+", "", sentence).translate(JAPANESE_QUOTES)
+
+
+def clean_english(sentence: str) -> str:
+    return re.sub(r"\s+", " ", sentence).strip()
+
+
+def ends_english_sentence(line: str, following: str) -> bool:
+    """Check whether a sentence ends with an english line, given the line after it."""
+    return (is_terminated(line, ENGLISH_TERMINAL, ENGLISH_CLOSING)
+            and not following[:1].islower())
+
+
+def join_english(lines: list) -> str:
+    """Join english lines, dropping an ellipsis that only carries a sentence over a line break."""
+    joined = []
+    for line, following in zip(lines, lines[1:] + [""]):
+        if following[:1].islower():
+            line = ENGLISH_CONTINUED.sub("", line).rstrip()
+        joined.append(line)
+    return clean_english(" ".join(joined))
+
+
+def terminate_japanese(sentence: str) -> str:
+    if is_terminated(sentence, JAPANESE_TERMINAL, JAPANESE_CLOSING):
+        return sentence
+    return sentence + "。"
+
+
+def local_extraction_consistent(input: Input, extracted: Extracted) -> bool:
+    """Check an extraction against the rules extract_sentences gives the model."""
+    english = extracted.sentence_english
+    try:
+        validation.check_source_text(extracted.sentence_japanese, input.subtitle_japanese)
+    except InvalidResponse:
+        return False
+    return (
+        clean_japanese(input.guide) in extracted.sentence_japanese
+        and is_terminated(english, ENGLISH_TERMINAL, ENGLISH_CLOSING)
+        # an untranslated english subtitle needs the model
+        and not JAPANESE_SCRIPT.search(english)
+    )
+
+
+def pick_sentence(guide: str, japanese: str, english: str) -> Optional[Extracted]:
+    """Pick the sentence holding the guide out of a segment both subtitles agree on.
+
+    A segment with several japanese sentences is only split if the english
+    side has as many, so that they pair up by position."""
+    japanese_sentences = JAPANESE_SENTENCE.findall(japanese)
+    english_sentences = [sentence.strip() for sentence in ENGLISH_SENTENCE.findall(english)]
+    if len(japanese_sentences) == 1:
+        return Extracted(sentence_japanese=terminate_japanese(japanese), sentence_english=english)
+    if len(japanese_sentences) != len(english_sentences):
+        return None
+    for japanese_sentence, english_sentence in zip(japanese_sentences, english_sentences):
+        if guide in japanese_sentence:
+            return Extracted(sentence_japanese=terminate_japanese(japanese_sentence),
+                             sentence_english=english_sentence)
+    # the guide runs over a sentence end
+    return None
+
+
+def extract_sentences_local(input: Input) -> Optional[Extracted]:
+    """Extract the sentences by subtitle line alignment, None when unsure.
+
+    The subtitles are taken as line by line translations and cut into
+    segments after every english line that ends a sentence; anime subtitles
+    often leave out japanese punctuation, english rarely does. The segment
+    holding the guide is then split at its punctuation and checked against
+    the rules of extract_sentences."""
+    japanese_lines = subtitle_lines(input.subtitle_japanese)
+    english_lines = subtitle_lines(input.subtitle_english)
+    guide = clean_japanese(input.guide)
+    if not guide or len(japanese_lines) != len(english_lines):
+        return None
+
+    begin = 0
+    for end, (line, following) in enumerate(zip(english_lines, english_lines[1:] + [""])):
+        if not ends_english_sentence(line, following):
+            continue
+        japanese = clean_japanese("".join(japanese_lines[begin:end + 1]))
+        if guide in japanese:
+            extracted = pick_sentence(guide, japanese, join_english(english_lines[begin:end + 1]))
+            if extracted is not None and local_extraction_consistent(input, extracted):
+                return extracted
+            return None
+        begin = end + 1
+
+    return None
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# local index of the stage fingerprints every processed note was built with
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fingerprints.sqlite")
+
+lock = threading.Lock()
+connection = None
+
+
+def fingerprint(*parts) -> str:
+    """Short stable hash of JSON-able parts."""
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def connect():
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute(
+            "create table if not exists fingerprints ("
+            " note_id integer, stage text, fingerprint text,"
+            " primary key (note_id, stage))")
+    return connection
+
+
+def load(note_id) -> dict:
+    """Fingerprints the fields of a note were last computed with, by stage."""
+    with lock:
+        return dict(connect().execute(
+            "select stage, fingerprint from fingerprints where note_id = ?",
+            (note_id,)).fetchall())
+
+
+def store(note_id, fingerprints: dict):
+    with lock:
+        connect().executemany(
+            "insert or replace into fingerprints (note_id, stage, fingerprint) values (?, ?, ?)",
+            [(note_id, stage, value) for stage, value in fingerprints.items()])
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+
+# seconds a single upstream call of a stage may take before it is abandoned,
+# stages not listed use default_deadline; None waits as long as it takes
+deadlines = dict(transcription=120.0)
+default_deadline = 60.0
+# send a duplicate request when a call is still running after the observed
+# percentile latency of its stage, once min_samples latencies are known
+enabled = False
+percentile = 0.95
+min_samples = 20
+window = 200
+# duplicate requests at most, as a fraction of all requests sent
+budget = 0.05
+# seconds one note may take in total, None for no limit
+note_budget = None
+
+lock = threading.Lock()
+latencies = defaultdict(lambda: deque(maxlen=window))
+sent = 0
+hedged = 0
+local = threading.local()
+
+
+class DeadlineExceeded(TimeoutError):
+    """An upstream call or a whole note ran out of time."""
+
+
+@contextmanager
+def time_budget(seconds):
+    """Limit every upstream call made by this thread inside the block to seconds in total."""
+    previous = getattr(local, "deadline", None)
+    if seconds is not None:
+        deadline = time.monotonic() + seconds
+        local.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        local.deadline = previous
+
+
+def note_left():
+    """Seconds left of the time budget of the note on this thread, None without one."""
+    deadline = getattr(local, "deadline", None)
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("time budget of the note exhausted")
+    return left
+
+
+def remaining(stage):
+    """Seconds the next call of a stage may take, None without any limit."""
+    limit = deadlines.get(stage, default_deadline)
+    deadline = getattr(local, "deadline", None)
+    if deadline is not None:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceeded(f"time budget of the note exhausted before {stage}")
+        limit = left if limit is None else min(limit, left)
+    return limit
+
+
+def hedge_delay(stage):
+    """Observed percentile latency of a stage, None while there are too few samples."""
+    with lock:
+        samples = sorted(latencies[stage])
+    if len(samples) < min_samples:
+        return None
+    return samples[min(int(len(samples) * percentile), len(samples) - 1)]
+
+
+def start(call, timeout):
+    """Run call(timeout) on a daemon thread, so an abandoned call never blocks exit."""
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(call(timeout))
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def allow_hedge() -> bool:
+    global sent, hedged
+    with lock:
+        if hedged + 1 > budget * (sent + 1):
+            return False
+        sent += 1
+        hedged += 1
+    return True
+
+
+def run(stage, call, stats):
+    """Run an upstream call of a stage within its deadline, hedged if enabled.
+
+    call(timeout) sends one request and is given the seconds left, so the
+    HTTP client can abort it as well. The first successful answer wins; a
+    call still running at the deadline is abandoned and DeadlineExceeded
+    raised. Duplicates count against budget and are counted as
+    "<stage>.hedged" in stats. Rate limit waits come before, so they are
+    neither part of the deadline nor of the latencies hedging learns from."""
+    global sent
+    limit = remaining(stage)
+    began = time.monotonic()
+    with lock:
+        sent += 1
+
+    def record(future):
+        if future.exception() is None:
+            with lock:
+                latencies[stage].append(time.monotonic() - began)
+
+    primary = start(call, limit)
+    primary.add_done_callback(record)
+    pending = {primary}
+    errors = []
+
+    hedge_at = hedge_delay(stage) if enabled else None
+    while pending:
+        elapsed = time.monotonic() - began
+        waits = [at - elapsed for at in (limit, hedge_at) if at is not None]
+        done, pending = wait(pending, max(min(waits), 0) if waits else None, FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    stats[f"{stage}.hedge_won"] += 1
+                return future.result()
+            errors.append(future.exception())
+        elapsed = time.monotonic() - began
+        if limit is not None and elapsed >= limit:
+            break
+        if hedge_at is not None and elapsed >= hedge_at:
+            hedge_at = None
+            if pending and allow_hedge():
+                stats[f"{stage}.hedged"] += 1
+                pending.add(start(call, None if limit is None else limit - elapsed))
+
+    if not pending:
+        raise errors[0]
+    stats[f"{stage}.deadline_exceeded"] += 1
+    raise DeadlineExceeded(f"{stage} took longer than {limit:.1f}s")
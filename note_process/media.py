@@ -0,0 +1,122 @@
+import base64
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+import ankiconnect
+from ankiconnect import invoke
+from common import AudioRef
+
+# base64 is decoded in slices of this many characters (a multiple of 4)
+DECODE_CHUNK = 1 << 20
+
+MEDIA_MODES = ("direct", "path", "base64")
+
+# "direct" reads and writes the media folder itself, "path" reads as base64
+# but lets AnkiConnect pick up written files from a local path, "base64" sends
+# everything through the API; detected on first use unless set explicitly
+media_mode = None
+media_dir = None
+
+
+def detect_media_mode():
+    """Pick the cheapest way to reach the collection media folder."""
+    global media_mode, media_dir
+    if media_dir is None and media_mode in (None, "direct"):
+        response = invoke("getMediaDirPath")
+        path = response.get("result")
+        if path and os.path.isdir(path) and os.access(path, os.R_OK | os.W_OK):
+            media_dir = path
+
+    if media_mode is None:
+        if media_dir is not None:
+            media_mode = "direct"
+        elif urlparse(ankiconnect.ANKICONNECT_URL).hostname in ("127.0.0.1", "localhost", "::1"):
+            media_mode = "path"
+        else:
+            media_mode = "base64"
+    if media_mode == "direct" and media_dir is None:
+        raise ValueError("Media folder is not accessible, direct media mode is unavailable.")
+
+    return media_mode
+
+
+def read_media_file(file_name) -> AudioRef:
+    """Reference a file of the collection media folder.
+
+    In direct mode the media file itself is referenced, otherwise it is
+    decoded slice by slice into a temporary file."""
+    if detect_media_mode() == "direct":
+        path = os.path.join(media_dir, file_name)
+        if not os.path.isfile(path):
+            raise ValueError(f"Audio file {file_name} not found.")
+        return AudioRef(path=path)
+
+    response = invoke("retrieveMediaFile", filename=file_name)
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error fetching audio: {
+                         response['error']}")
+
+    data = response.pop("result", None)
+    if not data:
+        raise ValueError(f"Audio file {file_name} not found.")
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file_name)[1], delete=False) as temp_file:
+        for offset in range(0, len(data), DECODE_CHUNK):
+            temp_file.write(base64.b64decode(data[offset:offset + DECODE_CHUNK]))
+    return AudioRef(path=temp_file.name, temporary=True)
+
+
+def store_media_file(file_name, audio: AudioRef):
+    """Write a file into the collection media folder."""
+    mode = detect_media_mode()
+    if mode == "direct":
+        # copy next to the target and rename, so Anki never sees a partial file
+        with tempfile.NamedTemporaryFile(dir=media_dir, prefix=".", delete=False) as temp_file:
+            with audio.open() as audio_file:
+                shutil.copyfileobj(audio_file, temp_file)
+        os.replace(temp_file.name, os.path.join(media_dir, file_name))
+        return
+
+    if mode == "path":
+        response = invoke("storeMediaFile", filename=file_name,
+                          path=os.path.abspath(audio.path))
+    else:
+        response = invoke("storeMediaFile", filename=file_name,
+                          data=base64.b64encode(audio.read()).decode("utf-8"))
+
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error uploading audio: {
+                         response['error']}")
+
+
+def media_file_size(file_name):
+    """Size of a media file, None if it is only known once the file is fetched."""
+    if detect_media_mode() == "direct":
+        path = os.path.join(media_dir, file_name)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+    return None
+
+
+def media_file_exists(file_name) -> bool:
+    """Check whether the collection media folder already has a file."""
+    if detect_media_mode() == "direct":
+        return os.path.isfile(os.path.join(media_dir, file_name))
+    return file_name in list_media_files(file_name)
+
+
+def list_media_files(pattern) -> list:
+    """List the media file names matching a glob pattern."""
+    response = invoke("getMediaFilesNames", pattern=pattern)
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error listing media: {
+                         response['error']}")
+    return response.get("result", [])
+
+
+def delete_media_file(file_name):
+    """Delete a file from the collection media folder through Anki."""
+    response = invoke("deleteMediaFile", filename=file_name)
+    if response.get("error") is not None:
+        raise ValueError(f"AnkiConnect error deleting media: {
+                         response['error']}")
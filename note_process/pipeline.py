@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+
+# marks the end of the items in a queue
+DONE = object()
+
+
+class Stage:
+    """Worker threads that take items from inbox and put the results into outbox.
+
+    function(item) returns the item for the next stage, or None to drop it.
+    An item whose function raised is handed to on_error and dropped. Once
+    inbox is DONE and every worker has finished, outbox gets DONE too."""
+
+    def __init__(self, name, function, inbox, outbox=None, workers=1, on_error=None):
+        self.name = name
+        self.function = function
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.on_error = on_error
+        self.running = workers
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self.work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                # pass the end on to the other workers of this stage
+                self.inbox.put(DONE)
+                break
+            self.handle(item)
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last and self.outbox is not None:
+            self.outbox.put(DONE)
+
+    def handle(self, item):
+        try:
+            result = self.function(item)
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(item, e)
+            return
+        if result is not None and self.outbox is not None:
+            self.outbox.put(result)
+
+
+class Batcher(Stage):
+    """Single worker that hands items to function in lists of up to size.
+
+    A batch is flushed when it is full, or when no item arrived for linger
+    seconds, so a slow trickle of items is not held back. on_error gets
+    every item of a batch whose function raised."""
+
+    def __init__(self, name, function, inbox, size, linger=1.0, on_error=None):
+        super().__init__(name, function, inbox, None, 1, on_error)
+        self.size = size
+        self.linger = linger
+
+    def work(self):
+        batch = []
+        while True:
+            try:
+                item = self.inbox.get(timeout=self.linger if batch else None)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not DONE:
+                batch.append(item)
+            if batch and (item is None or item is DONE or len(batch) >= self.size):
+                self.flush(batch)
+                batch = []
+            if item is DONE:
+                break
+
+    def flush(self, batch):
+        try:
+            self.function(batch)
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            for item in batch:
+                self.on_error(item, e)
+
+
+def source(items, outbox):
+    """Put every item into outbox, then DONE, on a thread of its own."""
+    def run():
+        try:
+            for item in items:
+                outbox.put(item)
+        finally:
+            outbox.put(DONE)
+
+    thread = threading.Thread(target=run, name="source", daemon=True)
+    thread.start()
+    return thread
+
+
+def run(items, stages):
+    """Feed items through stages that are already connected by their queues.
+
+    Returns the seconds the whole pipeline took."""
+    began = time.monotonic()
+    source(items, stages[0].inbox)
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    return time.monotonic() - began
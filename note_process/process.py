@@ -1,11 +1,15 @@
 import unicodedata
+import common
+import examples
+import speech
 from common import *
 from audio import *
-
-
-class Extracted(BaseModel):
-    sentence_japanese: str
-    sentence_english: str
+from splitter import *
+from extractor import *
+from prompts import *
+from validation import *
+from fingerprints import fingerprint
+from singleflight import shared
 
 
 def normalize_string(s):
@@ -14,34 +18,41 @@ def normalize_string(s):
     return s
 
 
-def fmt_examples(examples):
-    out = ""
-    for example in examples:
-        out += dedent(f"""
-        **Input:** {dump_data(example["input"])}
-        **Output:** {dump_data(example["output"])}
+def input_key(input: Input) -> str:
+    """Identity of the text of an input, the same for inputs that normalize alike."""
+    return fingerprint(
+        input.vocabulary, normalize_string(input.guide),
+        normalize_string(input.subtitle_japanese), normalize_string(input.subtitle_english))
 
-        """)
-    return out
 
+EXTRACT_SENTENCES = compile_prompt("extract_sentences", """
+    extract japanese and english sentences from given subtitles
+    - japanese sentence must
+    -- contain the vocabulary
+    -- be a contiguous substring of japanese subtitle
+    -- be a single and complete sentence
+    - english sentence must
+    -- correspond to japanese sentence
+    -- be based on english subtitle
+    clean up sentences
+    -- add punctuation if not already present
+    -- remove newlines
+    -- normalize whitespace
+    -- use japanese quotation marks (「」) in japanese sentence
+""", render_json_examples("examples"))
 
+
+@shared("extract_sentences", input_key)
 def extract_sentences(input: Input) -> Extracted:
-    system_content = dedent(f"""
-        extract japanese and english sentences from given subtitles
-        - japanese sentence must
-        -- contain the vocabulary
-        -- be a contiguous substring of japanese subtitle
-        -- be a single and complete sentence
-        - english sentence must
-        -- correspond to japanese sentence
-        -- be based on english subtitle
-        clean up sentences
-        -- add punctuation if not already present
-        -- remove newlines
-        -- normalize whitespace
-        -- use japanese quotation marks (「」) in japanese sentence
-        examples: {dump_data(examples.extract_sentences)}
-    """)
+    extracted = extract_sentences_local(input)
+    if extracted is not None:
+        stats["extract_sentences.hit"] += 1
+        if dump_inout:
+            out = dict(input=input.model_dump(exclude={"audio"}), output=extracted.model_dump())
+            print()
+            print(fmt_data(out))
+        return extracted
+    stats["extract_sentences.miss"] += 1
 
     user_content = dict(
         vocabulary=input.vocabulary,
@@ -50,12 +61,12 @@ def extract_sentences(input: Input) -> Extracted:
         subtitle_english=input.subtitle_english
     )
 
-    completion = client.beta.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user",   "content": dump_data(user_content)},
-        ],
+    completion = chat_cascade(
+        "extract_sentences",
+        lambda extracted: check_extracted(input, extracted),
+        messages=EXTRACT_SENTENCES.messages(
+            f"{input.vocabulary} {input.guide} {input.subtitle_japanese}",
+            dump_data(user_content)),
         response_format=Extracted
     )
 
@@ -69,47 +80,53 @@ def extract_sentences(input: Input) -> Extracted:
     return response
 
 
-def augment_furigana(sentence: str) -> str:
-    class Response(BaseModel):
-        furigana: str
-
-    system_content = dedent(f"""
-        **Objective:**
-        Enhance the given Japanese sentence by:
-        1. Adding **furigana** annotations using HTML `<ruby>` tags to provide readings for kanji and complex words.
-        2. Inserting whitespace between words to clearly separate them for easier parsing and readability.
-
-        ---
-
-        **Detailed Requirements:**
-        1. **Furigana Annotation**:
-        - Identify kanji or complex words in the sentence.
-        - Annotate these words with furigana readings using the `<ruby>` and `<rt>` tags.
-        - Preserve the original sentence structure while adding the annotations.
-
-        2. **Word Separation**:
-        - Add whitespace between individual words to improve readability.
-        - Words include particles, verbs, nouns, and other grammatical components.
-
-        3. **Output Format**:
-        - The output should be a string with furigana annotations and whitespace separating words.
-
-        ---
-
-        **Examples**:
-    """) + fmt_examples(examples.augment_furigana)
-
-    user_content = dict(sentence=sentence)
-
-    completion = client.beta.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": dump_data(user_content)}
-        ],
-        response_format=Response
+EXTRACT_SPLIT_SENTENCES = compile_prompt("extract_split_sentences", """
+    extract japanese and english sentences from given subtitles
+    - japanese sentence must
+    -- contain the vocabulary
+    -- be a contiguous substring of japanese subtitle
+    -- be a single and complete sentence
+    - english sentence must
+    -- correspond to japanese sentence
+    -- be based on english subtitle
+    clean up sentences
+    -- add punctuation if not already present
+    -- remove newlines
+    -- normalize whitespace
+    -- use japanese quotation marks (「」) in japanese sentence
+    split each sentence into prefix, middle and suffix
+    -- middle is the vocabulary or its equivalent expression in the sentence
+    -- prefix and suffix are everything before and after middle
+    -- prefix + middle + suffix is exactly the sentence
+""", render_json_examples("examples"))
+
+
+@shared("extract_split_sentences", input_key)
+def extract_split_sentences(input: Input) -> Optional[ExtractedSplit]:
+    """Extract both sentences already split around the vocabulary in one call.
+
+    Returns None if the split does not hold up on any model of the cascade,
+    the caller then falls back to separate extract and split calls."""
+    user_content = dict(
+        vocabulary=input.vocabulary,
+        guide=input.guide,
+        subtitle_japanese=input.subtitle_japanese,
+        subtitle_english=input.subtitle_english
     )
 
+    try:
+        completion = chat_cascade(
+            "extract_split_sentences",
+            lambda extracted: check_extracted_split(input, extracted),
+            messages=EXTRACT_SPLIT_SENTENCES.messages(
+                f"{input.vocabulary} {input.guide} {input.subtitle_japanese}",
+                dump_data(user_content)),
+            response_format=ExtractedSplit
+        )
+    except InvalidResponse as e:
+        print(f"Fused extract and split failed: {e}")
+        return None
+
     response = completion.choices[0].message.parsed
 
     if dump_inout:
@@ -117,45 +134,49 @@ def augment_furigana(sentence: str) -> str:
         print()
         print(fmt_data(out))
 
-    return response.furigana
+    return response
 
 
-class SplitIn(BaseModel):
-    vocabulary: str
-    sentence: str
+AUGMENT_FURIGANA = compile_prompt("augment_furigana", """
+    **Objective:**
+    Enhance the given Japanese sentence by:
+    1. Adding **furigana** annotations using HTML `<ruby>` tags to provide readings for kanji and complex words.
+    2. Inserting whitespace between words to clearly separate them for easier parsing and readability.
 
+    ---
 
-def split_sentences(input: [SplitIn]) -> [Triplet]:
-    class Response(BaseModel):
-        split_sentences: List[Triplet]
+    **Detailed Requirements:**
+    1. **Furigana Annotation**:
+    - Identify kanji or complex words in the sentence.
+    - Annotate these words with furigana readings using the `<ruby>` and `<rt>` tags.
+    - Preserve the original sentence structure while adding the annotations.
+
+    2. **Word Separation**:
+    - Add whitespace between individual words to improve readability.
+    - Words include particles, verbs, nouns, and other grammatical components.
+
+    3. **Output Format**:
+    - The output should be a string with furigana annotations and whitespace separating words.
 
-    system_content = dedent(f"""
-        **Objective:**
-        Split each given sentence into three parts: prefix, middle, and suffix. The "middle" corresponds to a specified vocabulary term or its equivalent expression in the sentence. The "prefix" and "suffix" are the parts of the sentence before and after the "middle," respectively. The concatenation of "prefix," "middle," and "suffix" must exactly recreate the original sentence, including all whitespaces, punctuation, and formatting.
+    ---
 
-        ---
+    **Examples**:
+""", fmt_examples)
 
-        **Detailed Requirements:**
-        1. Identify the **middle** as the expression in the sentence that corresponds to the specified "vocabulary."
-        2. Ensure the **prefix** consists of all content in the sentence before the "middle."
-        3. Ensure the **suffix** consists of all content in the sentence after the "middle."
-        4. Preserve all formatting, including whitespace, punctuation, and special annotations (e.g., `<ruby>` tags).
 
-        ---
+class FuriganaResponse(BaseModel):
+    furigana: str
 
-        **Examples:**
-        Examples: {dump_data(examples.split_sentences)}
-    """)
 
-    user_content = [split_in.model_dump() for split_in in input]
+@shared("augment_furigana", lambda sentence: sentence)
+def augment_furigana(sentence: str) -> str:
+    user_content = dict(sentence=sentence)
 
-    completion = client.beta.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": dump_data(user_content)}
-        ],
-        response_format=Response
+    completion = chat_cascade(
+        "augment_furigana",
+        lambda response: check_ruby(response.furigana, sentence),
+        messages=AUGMENT_FURIGANA.messages(sentence, dump_data(user_content)),
+        response_format=FuriganaResponse
     )
 
     response = completion.choices[0].message.parsed
@@ -165,31 +186,181 @@ def split_sentences(input: [SplitIn]) -> [Triplet]:
         print()
         print(fmt_data(out))
 
-    assert len(user_content) == len(response.split_sentences)
+    return response.furigana
+
 
-    for split_in, split_sentence in zip(input, response.split_sentences):
-        assert split_in.sentence == split_sentence.prefix + \
-            split_sentence.middle + split_sentence.suffix
+SPLIT_SENTENCES = compile_prompt("split_sentences", """
+    **Objective:**
+    Split each given sentence into three parts: prefix, middle, and suffix. The "middle" corresponds to a specified vocabulary term or its equivalent expression in the sentence. The "prefix" and "suffix" are the parts of the sentence before and after the "middle," respectively. The concatenation of "prefix," "middle," and "suffix" must exactly recreate the original sentence, including all whitespaces, punctuation, and formatting.
 
-    return response.split_sentences
+    ---
 
+    **Detailed Requirements:**
+    1. Identify the **middle** as the expression in the sentence that corresponds to the specified "vocabulary."
+    2. Ensure the **prefix** consists of all content in the sentence before the "middle."
+    3. Ensure the **suffix** consists of all content in the sentence after the "middle."
+    4. Preserve all formatting, including whitespace, punctuation, and special annotations (e.g., `<ruby>` tags).
+    5. If a sentence comes with the error of a previous answer, give a corrected split.
 
-def process(input: Input) -> Output:
+    ---
+
+    **Examples:**
+""", render_json_examples("Examples"))
+
+
+class SplitIn(BaseModel):
+    vocabulary: str
+    sentence: str
+
+
+class SplitResponse(BaseModel):
+    split_sentences: List[Triplet]
+
+
+def split_sentences(input: [SplitIn]) -> [Triplet]:
+    """Split the sentences, asking again only for the splits that failed validation."""
+    split_out = [None] * len(input)
+    pending = list(range(len(input)))
+    errors = {}
+    stats["split_sentences.calls"] += 1
+    for attempt in range(common.repair_attempts + 1):
+        user_content = []
+        for i in pending:
+            item = input[i].model_dump()
+            if i in errors:
+                item["error"] = errors[i]
+                if split_out[i] is not None:
+                    item["previous_answer"] = split_out[i].model_dump()
+            user_content.append(item)
+
+        completion = chat_parse(
+            "split_sentences",
+            model=cascade_model("split_sentences", attempt),
+            messages=SPLIT_SENTENCES.messages(
+                " ".join(input[i].sentence for i in pending),
+                dump_data(user_content)),
+            response_format=SplitResponse
+        )
+
+        response = completion.choices[0].message.parsed
+
+        if dump_inout:
+            out = dict(input=user_content, output=response.model_dump())
+            print()
+            print(fmt_data(out))
+
+        try:
+            check_split([input[i] for i in pending], response.split_sentences)
+            errors = {}
+        except InvalidResponse as e:
+            errors = {pending[i]: message for i, message in e.errors.items()}
+        if len(pending) == len(response.split_sentences):
+            for i, triplet in zip(pending, response.split_sentences):
+                split_out[i] = triplet
+
+        pending = sorted(errors)
+        if not pending:
+            return split_out
+        if attempt < common.repair_attempts:
+            stats["split_sentences.repaired"] += len(pending)
+            if cascade_model("split_sentences", attempt + 1) != cascade_model("split_sentences", attempt):
+                stats["split_sentences.escalated"] += 1
+            print(f"split_sentences: asking again for {len(pending)} invalid splits")
+
+    stats["split_sentences.failed"] += 1
+    raise InvalidResponse(f"{len(pending)} splits still invalid", errors)
+
+
+def normalize_input(input: Input):
     input.guide = normalize_string(input.guide)
     input.subtitle_japanese = normalize_string(input.subtitle_japanese)
     input.subtitle_english = normalize_string(input.subtitle_english)
-    extracted = extract_sentences(input)
+
+
+def extract_stage(input: Input) -> (Extracted, Optional[ExtractedSplit]):
+    """Extract the sentences, fused with the split of both if enabled."""
+    fused = None
+    if common.fuse_extract_split and extract_sentences_local(input) is None:
+        fused = extract_split_sentences(input)
+    if fused is not None:
+        extracted = Extracted(
+            sentence_japanese=join_triplet(fused.sentence_japanese),
+            sentence_english=join_triplet(fused.sentence_english))
+    else:
+        extracted = extract_sentences(input)
+    return extracted, fused
+
+
+def split_stage(vocabulary: str, sentences: list, split_out: list, fallback=(None, None, None)) -> list:
+    """Fill in the splits of [japanese, furigana, english] that are None.
+
+    japanese and furigana are split locally, then fallback splits are used;
+    the model only handles what is still missing."""
+    split_out = list(split_out)
+    if split_out[1] is None:
+        split_out[1] = split_furigana(vocabulary, sentences[1])
+    if split_out[0] is None:
+        split_out[0] = split_japanese(vocabulary, sentences[0], split_out[1])
+    split_out = [split or other for split, other in zip(split_out, fallback)]
+    pending = [i for i, split in enumerate(split_out) if split is None]
+    if pending:
+        split_in = [
+            SplitIn(vocabulary=vocabulary, sentence=sentences[i])
+            for i in pending
+        ]
+        for i, split in zip(pending, split_sentences(split_in)):
+            split_out[i] = split
+    return split_out
+
+
+def stage_fingerprints(input: Input, audio_name: str) -> dict:
+    """Fingerprint of every stage: its models, prompt, examples and inputs.
+
+    A stage takes the fingerprints of the stages it depends on as input,
+    so a change reaches everything computed from it and nothing else."""
+    extract = fingerprint(
+        "extract", cascades["extract_sentences"], EXTRACT_SENTENCES.digest,
+        examples.extract_sentences, common.fuse_extract_split and [
+            cascades["extract_split_sentences"], EXTRACT_SPLIT_SENTENCES.digest,
+            examples.extract_split_sentences],
+        input.model_dump(exclude={"audio"}))
+    furigana = fingerprint(
+        "furigana", cascades["augment_furigana"], AUGMENT_FURIGANA.digest,
+        examples.augment_furigana, extract)
+    # a new furigana sentence is split again with it, so the split of the
+    # japanese and english sentences does not depend on the furigana
+    split = fingerprint(
+        "split", cascades["split_sentences"], SPLIT_SENTENCES.digest,
+        examples.split_sentences, extract)
+    audio = fingerprint(
+        "audio", speech.backend.parameters(),
+        transcription_settings(),
+        cascades["find_japanese_sentence"], FIND_JAPANESE_SENTENCE.digest,
+        examples.find_japanese_sentence, align_threshold, audio_name, extract)
+    return dict(extract=extract, furigana=furigana, split=split, audio=audio)
+
+
+def process_text(input: Input) -> (Extracted, list):
+    """Extract the sentences and split [japanese, furigana, english]."""
+    normalize_input(input)
+    extracted, fused = extract_stage(input)
 
     sentence_japanese = extracted.sentence_japanese
     sentence_furigana = augment_furigana(sentence_japanese)
     sentence_english = extracted.sentence_english
 
-    split_in = [
-        SplitIn(vocabulary=input.vocabulary, sentence=sentence_japanese),
-        SplitIn(vocabulary=input.vocabulary, sentence=sentence_furigana),
-        SplitIn(vocabulary=input.vocabulary, sentence=sentence_english),
-    ]
-    split_out = split_sentences(split_in)
+    fallback = [None, None, None]
+    if fused is not None:
+        fallback = [fused.sentence_japanese, None, fused.sentence_english]
+    split_out = split_stage(
+        input.vocabulary,
+        [sentence_japanese, sentence_furigana, sentence_english],
+        [None, None, None], fallback)
+    return extracted, split_out
+
+
+def process(input: Input) -> Output:
+    extracted, split_out = process_text(input)
     [sentence_japanese, sentence_furigana, sentence_english] = split_out
 
     audio = extract_relevant_audio(
@@ -0,0 +1,69 @@
+import hashlib
+from pydantic import ConfigDict
+from common import *
+from selector import *
+
+
+def fmt_examples(examples):
+    out = ""
+    for example in examples:
+        out += dedent(f"""
+        **Input:** {dump_data(example["input"])}
+        **Output:** {dump_data(example["output"])}
+
+        """)
+    return out
+
+
+def render_json_examples(label):
+    return lambda examples: f"{label}: {dump_data(examples)}\n"
+
+
+# prompt prefix the provider caches at least, in tokens; a shorter static
+# part is never cached
+cache_prefix_tokens = 1024
+
+
+class Prompt(BaseModel):
+    """System prompt of one stage, compiled once at startup.
+
+    The static part is byte-identical across calls, so providers can cache
+    it: the instructions and a fixed block of examples, long enough to reach
+    cache_prefix_tokens. Examples selected for the input from the rest
+    follow it and the per-note payload comes last. With example selection
+    disabled (example_count of the stage set to None), or when all examples
+    fit the fixed block, every example is part of the static prefix."""
+    model_config = ConfigDict(frozen=True)
+
+    stage: str
+    static: str
+    render: object
+    index: object
+    digest: str
+
+    def messages(self, query, payload) -> list:
+        messages = [{"role": "system", "content": self.static}]
+        if self.index is not None:
+            examples = self.index.select(
+                query, example_count[self.stage], example_budget[self.stage])
+            messages.append({"role": "system", "content": self.render(examples)})
+        messages.append({"role": "user", "content": payload})
+        return messages
+
+
+def compile_prompt(stage, instructions, render) -> Prompt:
+    """Dedent the instructions once and decide where the examples go."""
+    static = dedent(instructions)
+    items = getattr(examples, stage)
+    fixed = len(items)
+    if example_count.get(stage) is not None:
+        fixed = 0
+        while fixed < len(items) and estimate_tokens(static + render(items[:fixed])) < cache_prefix_tokens:
+            fixed += 1
+    static += render(items[:fixed])
+    return Prompt(
+        stage=stage,
+        static=static,
+        render=render,
+        index=ExampleIndex(stage, items[fixed:]) if fixed < len(items) else None,
+        digest=hashlib.sha256(static.encode("utf-8")).hexdigest())
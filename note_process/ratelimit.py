@@ -0,0 +1,191 @@
+import threading
+import time
+import openai
+import hedging
+
+# fraction of the quota to use, below 1.0 leaves room for other clients of the key
+utilization = 1.0
+# completion tokens assumed for a chat request until its usage is known
+completion_tokens = 500
+# how often a request answered with 429 is queued again before it fails
+rate_limit_retries = 6
+# how often a request that failed to connect or with a server error is sent
+# again, with exponential backoff; the client itself never retries
+error_retries = 2
+
+class Bucket:
+    """Request and token buckets of one queue, served in arrival order.
+
+    Both refill continuously at their per-minute capacity. A request waits
+    until its estimated tokens are available and it is the oldest waiting."""
+
+    def __init__(self, name, requests=None, tokens=None):
+        self.name = name
+        self.capacity = dict(requests=requests, tokens=tokens)
+        self.level = dict(requests=requests or 0.0, tokens=tokens or 0.0)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.tickets = 0
+        self.serving = 0
+        self.abandoned = set()
+
+    def refill(self, now):
+        for kind, capacity in self.capacity.items():
+            if capacity is not None:
+                self.level[kind] = min(
+                    capacity, self.level[kind] + capacity / 60 * (now - self.updated))
+        self.updated = now
+
+    def wait_time(self, cost, now) -> float:
+        """Seconds until cost is available, 0 when it is now."""
+        wait = max(self.paused_until - now, 0.0)
+        for kind, capacity in self.capacity.items():
+            if capacity is not None:
+                missing = min(cost[kind], capacity) - self.level[kind]
+                if missing > 0:
+                    wait = max(wait, missing / capacity * 60)
+        return wait
+
+    def acquire(self, tokens, timeout=None) -> float:
+        """Take one request and tokens from the buckets, return the seconds waited."""
+        cost = dict(requests=1, tokens=tokens)
+        began = time.monotonic()
+        with self.condition:
+            ticket = self.tickets
+            self.tickets += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    wait = self.wait_time(cost, now) if ticket == self.serving else None
+                    if wait == 0:
+                        break
+                    if timeout is not None and now - began >= timeout:
+                        raise hedging.DeadlineExceeded(f"no {self.name} rate limit capacity in time")
+                    if timeout is not None:
+                        left = timeout - (now - began)
+                        wait = left if wait is None else min(wait, left)
+                    self.condition.wait(wait)
+                for kind in cost:
+                    if self.capacity[kind] is not None:
+                        self.level[kind] -= cost[kind]
+            finally:
+                # a waiter that gave up must not hold up the ones behind it
+                if ticket == self.serving:
+                    self.serving += 1
+                else:
+                    self.abandoned.add(ticket)
+                while self.serving in self.abandoned:
+                    self.abandoned.remove(self.serving)
+                    self.serving += 1
+                self.condition.notify_all()
+        return time.monotonic() - began
+
+    def settle(self, estimated, used):
+        """Correct the token bucket once the real usage of a request is known."""
+        with self.condition:
+            if self.capacity["tokens"] is not None:
+                self.level["tokens"] -= used - estimated
+
+    def update(self, headers):
+        """Adopt the limits and remaining quota the server reports."""
+        with self.condition:
+            for kind in ("requests", "tokens"):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is None:
+                    continue
+                self.refill(time.monotonic())
+                capacity = float(limit) * utilization
+                if self.capacity[kind] is None:
+                    self.level[kind] = capacity
+                self.capacity[kind] = capacity
+                if remaining is not None:
+                    reserve = float(limit) - capacity
+                    self.level[kind] = min(self.level[kind], float(remaining) - reserve)
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        """Send nothing more for seconds and start again from empty buckets."""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            for kind in self.level:
+                self.level[kind] = min(self.level[kind], 0.0)
+            self.condition.notify_all()
+
+
+# chat and transcription are limited separately; a queue without configured
+# limits learns them from the rate limit headers of its first answer
+buckets = dict(
+    chat=Bucket("chat"),
+    transcription=Bucket("transcription"),
+)
+
+
+def configure(name, requests=None, tokens=None):
+    """Set the per-minute limits of a queue instead of learning them from headers."""
+    buckets[name] = Bucket(name, requests, tokens)
+
+
+def retry_after(headers, attempt, bucket) -> float:
+    """Seconds to back off after a 429.
+
+    As told by the server, else none once the limits are known: the paused
+    bucket starts from empty and refills one request's worth at its own
+    pace. The reset headers tell when the quota is full again, which can be
+    minutes, so they are not waited for. Unknown limits back off exponentially."""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    if any(capacity is not None for capacity in bucket.capacity.values()):
+        return 0.0
+    return min(2 ** attempt, 60)
+
+
+def run(queue, tokens, call, stats):
+    """Send a request through the rate limiter of a queue.
+
+    call() sends the request with the raw response API, within its own
+    deadline and hedged; its rate limit headers update the bucket and the
+    parsed response is returned. Capacity is taken before the request is
+    sent, the wait is only bounded by the time budget of the note, so a
+    throttled queue delays notes instead of failing them. Waits are counted
+    as "<queue>.throttled" in stats. A 429 pauses the whole queue and
+    requeues the request, a connection or server error is retried after a
+    backoff."""
+    bucket = buckets[queue]
+    rate_limited = errors = 0
+    while True:
+        if bucket.acquire(tokens, hedging.note_left()) > 0.01:
+            stats[f"{queue}.throttled"] += 1
+        try:
+            raw = call()
+        except openai.RateLimitError as e:
+            stats[f"{queue}.rate_limited"] += 1
+            if rate_limited == rate_limit_retries:
+                raise
+            bucket.pause(retry_after(e.response.headers, rate_limited, bucket))
+            rate_limited += 1
+            continue
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            # a timeout is the deadline of the call, hedging deals with it
+            delay = min(0.5 * 2 ** errors, 8.0)
+            left = hedging.note_left()
+            if (errors == error_retries or isinstance(e, openai.APITimeoutError)
+                    or (left is not None and delay >= left)):
+                raise
+            stats[f"{queue}.retried"] += 1
+            time.sleep(delay)
+            errors += 1
+            continue
+        bucket.update(raw.headers)
+        response = raw.parse()
+        usage = getattr(response, "usage", None)
+        if getattr(usage, "total_tokens", None) is not None:
+            bucket.settle(tokens, usage.total_tokens)
+        return response
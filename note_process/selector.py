@@ -0,0 +1,81 @@
+import math
+from collections import Counter
+from common import *
+import examples
+
+NGRAM_SIZES = (1, 2, 3)
+
+# examples selected per input at most, on top of the fixed examples of the
+# cached prompt prefix, and the estimated prompt tokens they may take; the
+# most similar example is always kept, whatever its size
+example_count = dict(
+    extract_sentences=2,
+    extract_split_sentences=2,
+    augment_furigana=2,
+    split_sentences=2,
+    find_japanese_sentence=1,
+)
+example_budget = dict(
+    extract_sentences=600,
+    extract_split_sentences=800,
+    augment_furigana=600,
+    split_sentences=1200,
+    find_japanese_sentence=3000,
+)
+
+
+def example_text(stage, example) -> str:
+    """The part of an example that is compared against the current input."""
+    data = example["input"]
+    if stage == "split_sentences":
+        return " ".join(item["sentence"] for item in data)
+    if stage == "find_japanese_sentence":
+        return data["japanese_sentence"]
+    if stage in ("extract_sentences", "extract_split_sentences"):
+        return f"{data['vocabulary']} {data['guide']} {data['subtitle_japanese']}"
+    return data["sentence"]
+
+
+def ngrams(text) -> Counter:
+    text = "".join(text.split())
+    return Counter(
+        text[i:i + n]
+        for n in NGRAM_SIZES
+        for i in range(len(text) - n + 1))
+
+
+class ExampleIndex:
+    """Character n-gram tf-idf index over the examples of one stage."""
+
+    def __init__(self, stage, items):
+        self.stage = stage
+        self.items = items
+        counts = [ngrams(example_text(stage, item)) for item in items]
+        document_frequency = Counter(gram for count in counts for gram in count)
+        self.idf = {
+            gram: math.log((1 + len(items)) / (1 + frequency)) + 1
+            for gram, frequency in document_frequency.items()
+        }
+        self.vectors = [self.vectorize(count) for count in counts]
+        self.tokens = [estimate_tokens(dump_data(item)) for item in items]
+
+    def vectorize(self, count):
+        vector = {gram: n * self.idf.get(gram, 0.0) for gram, n in count.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {gram: value / norm for gram, value in vector.items()}
+
+    def select(self, text, count, budget) -> list:
+        """Return up to count examples most similar to text within the token budget."""
+        query = self.vectorize(ngrams(text))
+        ranked = sorted(
+            range(len(self.items)),
+            key=lambda i: -sum(query.get(gram, 0.0) * value
+                               for gram, value in self.vectors[i].items()))
+        selected = []
+        used = 0
+        for i in ranked[:count]:
+            if selected and used + self.tokens[i] > budget:
+                break
+            selected.append(self.items[i])
+            used += self.tokens[i]
+        return selected
@@ -0,0 +1,53 @@
+import copy
+import threading
+from concurrent.futures import Future
+from functools import wraps
+
+import hedging
+from common import stats
+
+# share one call between concurrent identical requests of a stage
+enabled = True
+
+lock = threading.Lock()
+in_flight = {}
+
+
+def do(stage, key, call):
+    """Run call(), or wait for the identical call of stage already in flight.
+
+    Only calls that overlap are shared, nothing is kept once the leader is
+    done. Every waiter gets its own copy of the result, or the exception."""
+    if not enabled:
+        return call()
+    with lock:
+        future = in_flight.get((stage, key))
+        leader = future is None
+        if leader:
+            future = in_flight[(stage, key)] = Future()
+    if not leader:
+        stats[f"{stage}.deduped"] += 1
+        try:
+            return copy.deepcopy(future.result(timeout=hedging.note_left()))
+        except TimeoutError:
+            raise hedging.DeadlineExceeded(f"time budget of the note exhausted waiting for {stage}")
+    try:
+        result = call()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with lock:
+            del in_flight[(stage, key)]
+
+
+def shared(stage, key):
+    """Decorate a function so concurrent calls with the same key(*args) run it once."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return do(stage, key(*args, **kwargs), lambda: function(*args, **kwargs))
+        return wrapper
+    return decorate
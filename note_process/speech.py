@@ -0,0 +1,258 @@
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future
+from typing import Protocol
+from common import *
+from openai.types.audio import TranscriptionVerbose
+import cassette
+import hedging
+import ratelimit
+
+
+class TranscriptionBackend(Protocol):
+    """Turns an audio file into a list of words with start and end timestamps."""
+
+    def parameters(self) -> dict:
+        """What the words are transcribed with, part of the keys of stored transcriptions."""
+        ...
+
+    def transcribe(self, audio_path: str, sentence: str) -> list:
+        ...
+
+
+class OpenAIBackend:
+    """Hosted whisper-1 transcription."""
+
+    model = "whisper-1"
+
+    def parameters(self) -> dict:
+        return dict(model=self.model)
+
+    def transcribe(self, audio_path: str, sentence: str) -> list:
+        prompt = f"sentence hint: {sentence}"
+
+        def request(timeout):
+            # every attempt opens the file itself, a hedged duplicate reads it concurrently
+            with open(audio_path, "rb") as audio_file:
+                return client.audio.transcriptions.with_raw_response.create(
+                    prompt=prompt,
+                    file=audio_file,
+                    model=self.model,
+                    response_format="verbose_json",
+                    timestamp_granularities=["word"],
+                    timeout=timeout
+                )
+
+        transcription = cassette.wrap(
+            "transcription",
+            lambda: dict(model=self.model, prompt=prompt,
+                         audio=AudioRef(path=audio_path).digest()),
+            lambda: ratelimit.run(
+                "transcription", 0,
+                lambda: hedging.run("transcription", request, stats),
+                stats),
+            lambda transcription: transcription.model_dump(mode="json"),
+            TranscriptionVerbose.model_validate)
+
+        return [
+            {
+                "start": word.start,
+                "end": word.end,
+                "text": word.word
+            }
+            for word in transcription.words
+        ]
+
+
+class LocalWhisperBackend:
+    """Whisper on the local CPU through faster-whisper.
+
+    The model is loaded on first use and shared by all notes and threads."""
+
+    def __init__(self, model_size="small", compute_type="int8", cpu_threads=0, num_workers=1):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.model = None
+        self.lock = threading.Lock()
+
+    def parameters(self) -> dict:
+        return dict(model="faster-whisper", model_size=self.model_size,
+                    compute_type=self.compute_type)
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                from faster_whisper import WhisperModel
+                self.model = WhisperModel(
+                    self.model_size,
+                    device="cpu",
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    num_workers=self.num_workers)
+        return self.model
+
+    def transcribe(self, audio_path: str, sentence: str) -> list:
+        segments, _ = self.load().transcribe(
+            audio_path,
+            language="ja",
+            initial_prompt=f"sentence hint: {sentence}",
+            word_timestamps=True)
+
+        return [
+            {
+                "start": word.start,
+                "end": word.end,
+                "text": word.word
+            }
+            for segment in segments
+            for word in segment.words
+        ]
+
+
+# batched clips are decoded to 16 kHz mono 16 bit pcm
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+
+def decode_pcm(audio_path: str) -> bytes:
+    return subprocess.run(
+        ["ffmpeg", "-i", audio_path, "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        check=True, capture_output=True).stdout
+
+
+def encode_mp3(pcm: bytes) -> AudioRef:
+    output_path = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False).name
+    subprocess.run(
+        ["ffmpeg", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+         "-b:a", "32k", output_path, "-y"],
+        input=pcm, check=True, capture_output=True)
+    return AudioRef(path=output_path, temporary=True)
+
+
+class BatchingBackend:
+    """Transcribes the clips of concurrent callers together in one request.
+
+    Clips that arrive within linger seconds, up to max_clips of them and
+    max_seconds of audio, are joined with gap seconds of silence and
+    transcribed by the wrapped backend at once. Every word goes back to
+    the clip its middle falls into, with the offset of the clip removed.
+    Longer clips are transcribed on their own."""
+
+    def __init__(self, inner, max_clips=8, max_seconds=60.0, linger=0.2, gap=1.0):
+        self.inner = inner
+        self.max_clips = max_clips
+        self.max_seconds = max_seconds
+        self.linger = linger
+        self.gap = gap
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def __getattr__(self, name):
+        # settings like model_size are those of the wrapped backend
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def parameters(self) -> dict:
+        # batching does not change what the words are transcribed with
+        return self.inner.parameters()
+
+    def transcribe(self, audio_path: str, sentence: str) -> list:
+        pcm = decode_pcm(audio_path)
+        if len(pcm) / BYTES_PER_SECOND > self.max_seconds:
+            return self.inner.transcribe(audio_path, sentence)
+
+        future = Future()
+        batch = None
+        with self.lock:
+            self.pending.append((audio_path, pcm, sentence, future))
+            pending_seconds = sum(len(item[1]) for item in self.pending) / BYTES_PER_SECOND
+            if len(self.pending) >= self.max_clips or pending_seconds >= self.max_seconds:
+                batch, self.pending = self.pending, []
+            elif len(self.pending) == 1:
+                timer = threading.Timer(self.linger, self.flush)
+                timer.daemon = True
+                timer.start()
+        if batch:
+            self.run_batch(batch)
+        return future.result()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                audio_path, _, sentence, future = batch[0]
+                future.set_result(self.inner.transcribe(audio_path, sentence))
+                return
+            for words, (_, _, _, future) in zip(self.transcribe_joined(batch), batch):
+                future.set_result(words)
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def transcribe_joined(self, batch) -> list:
+        """Transcribe the clips of a batch as one audio file, return the words per clip."""
+        silence = bytes(int(self.gap * SAMPLE_RATE) * 2)
+        bounds = []
+        position = 0
+        for _, pcm, _, _ in batch:
+            bounds.append((position, position + len(pcm)))
+            position += len(pcm) + len(silence)
+        joined = encode_mp3(silence.join(pcm for _, pcm, _, _ in batch))
+        try:
+            words = self.inner.transcribe(
+                joined.path, " ".join(sentence for _, _, sentence, _ in batch))
+        finally:
+            joined.release()
+        stats["transcription.batches"] += 1
+        stats["transcription.batched_clips"] += len(batch)
+
+        half_gap = self.gap / 2
+        clips = [[] for _ in batch]
+        for word in words:
+            start = word.get("start")
+            end = word.get("end", start)
+            if start is None:
+                continue
+            middle = (start + (end if end is not None else start)) / 2
+            for clip, (begin, stop) in zip(clips, bounds):
+                offset = begin / BYTES_PER_SECOND
+                duration = (stop - begin) / BYTES_PER_SECOND
+                if offset - half_gap <= middle < offset + duration + half_gap:
+                    # a word reaching into the gap is clamped to its clip
+                    clip.append(dict(
+                        word, start=min(max(start - offset, 0.0), duration),
+                        end=None if end is None else min(max(end - offset, 0.0), duration)))
+                    break
+        return clips
+
+
+backends = {
+    "openai": OpenAIBackend,
+    "local": LocalWhisperBackend,
+}
+
+backend: TranscriptionBackend = OpenAIBackend()
+
+
+def use_backend(name: str, **options):
+    """Select the transcription backend used by transcribe_audio."""
+    global backend
+    backend = backends[name](**options)
+    return backend
+
+
+def use_batching(**options):
+    """Batch the clips of concurrent notes into shared requests of the current backend."""
+    global backend
+    backend = BatchingBackend(backend, **options)
+    return backend
@@ -0,0 +1,159 @@
+import re
+from common import *
+from typing import Optional
+
+# visible text of a ruby-annotated sentence: readings, tags and whitespace are skipped
+RUBY_TOKEN = re.compile(r"<rt>.*?</rt>|<rp>.*?</rp>|<[^>]+>|\s|.", re.S)
+HIRAGANA = "".join(chr(c) for c in range(0x3041, 0x309F))
+
+
+def ruby_chars(sentence: str) -> list:
+    """Map each visible character of a sentence to the markup span it occupies.
+
+    Characters inside a <ruby> element span the whole element, so that any
+    split at these boundaries keeps the markup well-formed."""
+    chars = []
+    ruby_begin = None
+    ruby_chars_begin = 0
+    for match in RUBY_TOKEN.finditer(sentence):
+        token = match.group()
+        if token.startswith("<ruby"):
+            ruby_begin = match.start()
+            ruby_chars_begin = len(chars)
+        elif token == "</ruby>":
+            for char in chars[ruby_chars_begin:]:
+                char[1] = ruby_begin
+                char[2] = match.end()
+            ruby_begin = None
+        elif token.isspace() or (token.startswith("<") and len(token) > 1):
+            continue
+        else:
+            chars.append([token, match.start(), match.end()])
+    return chars
+
+
+def ruby_plain(sentence: str) -> str:
+    """Return the visible text of a sentence without readings, tags and whitespace."""
+    return "".join(char[0] for char in ruby_chars(sentence))
+
+
+def is_kanji(char: str) -> bool:
+    return "\u4e00" <= char <= "\u9fff" or char == "々"
+
+
+# kana a conjugated form may continue with after the stem and all but the
+# last okurigana, by the last okurigana of the dictionary form
+CONJUGATIONS = {
+    "う": "わいうえおっ",
+    # 行く is the one く verb with っ
+    "く": "かきくけこいっ",
+    "ぐ": "がぎぐげごい", "す": "さしすせそ",
+    "つ": "たちつてとっ", "ぬ": "なにぬねのん", "ぶ": "ばびぶべぼん", "む": "まみむめもん",
+    # godan and ichidan verbs ending in る
+    "る": "らりるれろったてなまよさずぬ",
+    "い": "いかくけさそすぎ",
+}
+
+
+def conjugation_follows(okurigana: str, following: str) -> bool:
+    """Check whether following text continues a stem as a form of its okurigana."""
+    if okurigana == "する":
+        return following[:1] in tuple("さしすせ")
+    if not following.startswith(okurigana[:-1]):
+        return False
+    rest = following[len(okurigana) - 1:]
+    return bool(rest) and rest[0] in CONJUGATIONS.get(okurigana[-1], "")
+
+
+def starts_word(plain: str, index: int, length: int, chars=None) -> bool:
+    """Check that a stem match is a word of its own, not part of a compound.
+
+    With the ruby_chars of the text, the match also has to cover whole ruby bases."""
+    if index > 0 and is_kanji(plain[index - 1]):
+        return False
+    if chars is None:
+        return True
+    end = index + length
+    if index > 0 and chars[index - 1][1] == chars[index][1]:
+        return False
+    return end >= len(chars) or chars[end][1] != chars[end - 1][1]
+
+
+def find_vocabulary(vocabulary: str, plain: str, chars=None):
+    """Find the vocabulary or the stem of its conjugated form in plain text.
+
+    A stem only matches where it starts a word and is followed by a form of
+    the okurigana; chars are the ruby_chars plain was taken from, if any.
+    Returns (index, length, conjugated) or None."""
+    index = plain.find(vocabulary)
+    if index >= 0:
+        return index, len(vocabulary), False
+
+    stem = vocabulary.rstrip(HIRAGANA)
+    if not stem or stem == vocabulary:
+        return None
+    okurigana = vocabulary[len(stem):]
+
+    index = plain.find(stem)
+    while index >= 0:
+        following = plain[index + len(stem):]
+        if (conjugation_follows(okurigana, following)
+                and starts_word(plain, index, len(stem), chars)):
+            return index, len(stem), True
+        index = plain.find(stem, index + 1)
+    return None
+
+
+def make_triplet(sentence: str, begin: int, end: int) -> Triplet:
+    return Triplet(
+        prefix=sentence[:begin],
+        middle=sentence[begin:end],
+        suffix=sentence[end:])
+
+
+def split_furigana(vocabulary: str, sentence: str) -> Optional[Triplet]:
+    """Split a furigana sentence around the vocabulary without asking the model.
+
+    A conjugated form extends over the following okurigana up to the next
+    word boundary, which augment_furigana marks with whitespace."""
+    chars = ruby_chars(sentence)
+    found = find_vocabulary(ruby_plain(vocabulary), ruby_plain(sentence), chars)
+    if found is None:
+        return None
+
+    index, length, conjugated = found
+    begin = chars[index][1]
+    end = chars[index + length - 1][2]
+    if conjugated:
+        while end < len(sentence) and sentence[end] in HIRAGANA:
+            end += 1
+    return make_triplet(sentence, begin, end)
+
+
+def split_japanese(vocabulary: str, sentence: str, furigana: Optional[Triplet] = None) -> Optional[Triplet]:
+    """Split a plain japanese sentence around the vocabulary without asking the model.
+
+    If the furigana variant has been split already, its middle decides the
+    extent of a conjugated form; otherwise only exact matches are accepted."""
+    chars = ruby_chars(sentence)
+    plain = "".join(char[0] for char in chars)
+
+    if furigana is not None:
+        middle = ruby_plain(furigana.middle)
+        index = len(ruby_plain(furigana.prefix))
+        if plain[index:index + len(middle)] != middle:
+            index = plain.find(middle)
+        if middle and index >= 0:
+            return make_triplet(
+                sentence,
+                chars[index][1],
+                chars[index + len(middle) - 1][2])
+
+    vocabulary = ruby_plain(vocabulary)
+    index = plain.find(vocabulary)
+    if not vocabulary or index < 0:
+        return None
+    return make_triplet(
+        sentence,
+        chars[index][1],
+        chars[index + len(vocabulary) - 1][2])
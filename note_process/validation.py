@@ -0,0 +1,107 @@
+import re
+import unicodedata
+from common import *
+from splitter import *
+
+RUBY_TAG = re.compile(r"</?(ruby|rt|rp)>")
+
+
+def join_triplet(triplet: Triplet) -> str:
+    return triplet.prefix + triplet.middle + triplet.suffix
+
+
+def text_content(text: str) -> str:
+    """Letters and digits of a text, without readings, tags, punctuation and whitespace."""
+    return "".join(
+        char for char in unicodedata.normalize("NFKC", ruby_plain(text))
+        if unicodedata.category(char)[0] in "LN")
+
+
+def check_source_text(sentence: str, source: str):
+    """Check that the sentence keeps the text of the source.
+
+    Cleanup may drop parts of the source and change punctuation and
+    whitespace, the letters that remain must appear in the source in order."""
+    remaining = iter(text_content(source))
+    if not all(char in remaining for char in text_content(sentence)):
+        raise InvalidResponse(f"{sentence} is not taken from the subtitle {source}")
+
+
+def count_vocabulary(vocabulary: str, sentence: str):
+    """Count a sentence without the vocabulary in it.
+
+    Only a hint: a dictionary form in kanji is often conjugated or written
+    in kana in the sentence, which this literal match does not see."""
+    if find_vocabulary(ruby_plain(vocabulary), ruby_plain(sentence)) is None:
+        stats["validation.vocabulary_not_found"] += 1
+
+
+def check_ruby(furigana: str, sentence: str):
+    """Check that furigana only adds well-formed ruby markup and whitespace to the sentence."""
+    depth = []
+    for match in RUBY_TAG.finditer(furigana):
+        tag = match.group()
+        if not tag.startswith("</"):
+            if tag == "<ruby>" and depth:
+                raise InvalidResponse("nested <ruby>")
+            if tag != "<ruby>" and depth != ["ruby"]:
+                raise InvalidResponse(f"{tag} outside of <ruby>")
+            depth.append(match.group(1))
+        elif not depth or depth[-1] != match.group(1):
+            raise InvalidResponse(f"unbalanced {tag}")
+        else:
+            depth.pop()
+    if depth:
+        raise InvalidResponse("unclosed <ruby>")
+    if ruby_plain(furigana) != "".join(sentence.split()):
+        raise InvalidResponse("furigana changes the sentence text")
+
+
+def check_triplet(triplet: Triplet, sentence: str):
+    if join_triplet(triplet) != sentence:
+        raise InvalidResponse(f"prefix + middle + suffix does not recreate {sentence}")
+
+
+def check_extracted(input: Input, extracted: Extracted):
+    if not text_content(extracted.sentence_japanese):
+        raise InvalidResponse("empty japanese sentence")
+    check_source_text(extracted.sentence_japanese, input.subtitle_japanese)
+    if not extracted.sentence_english.strip():
+        raise InvalidResponse("empty english sentence")
+    count_vocabulary(input.vocabulary, extracted.sentence_japanese)
+
+
+def check_extracted_split(input: Input, extracted: ExtractedSplit):
+    japanese = extracted.sentence_japanese
+    if not japanese.middle.strip():
+        raise InvalidResponse(f"empty middle for {join_triplet(japanese)}")
+    check_source_text(join_triplet(japanese), input.subtitle_japanese)
+    english = extracted.sentence_english
+    # the english split is used as it is, without a split stage after it
+    if not english.middle.strip():
+        raise InvalidResponse(f"empty middle for {join_triplet(english)}")
+    count_vocabulary(input.vocabulary, join_triplet(japanese))
+
+
+def check_split(split_in: list, split_out: list):
+    """Check every split, the errors of the raised InvalidResponse are per item."""
+    if len(split_in) != len(split_out):
+        raise InvalidResponse(
+            f"{len(split_out)} splits for {len(split_in)} sentences",
+            {i: "missing from the answer" for i in range(len(split_in))})
+    errors = {}
+    for i, (item, triplet) in enumerate(zip(split_in, split_out)):
+        try:
+            check_triplet(triplet, item.sentence)
+        except InvalidResponse as e:
+            errors[i] = str(e)
+    if errors:
+        raise InvalidResponse(f"{len(errors)} of {len(split_in)} splits invalid", errors)
+
+
+def check_cut_range(cut_range: CutRange, transcription: list):
+    ends = [word["end"] for word in transcription if word.get("end") is not None]
+    if not 0 <= cut_range.begin < cut_range.end:
+        raise InvalidResponse(f"empty range {cut_range.begin}-{cut_range.end}")
+    if ends and cut_range.begin > max(ends):
+        raise InvalidResponse("range begins after the transcription ends")
@@ -0,0 +1,164 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# a note that failed this often is moved to the dead letters
+max_attempts = 3
+# seconds a claimed note belongs to its worker; a worker that died is
+# replaced once its lease runs out
+lease_seconds = 600.0
+# a worker renews the lease of the note it works on this often
+renew_seconds = 60.0
+
+SCHEMA = """
+create table if not exists notes (
+    note_id integer primary key,
+    state text not null default 'pending',
+    attempts integer not null default 0,
+    worker text,
+    lease_until real,
+    error text,
+    updated real
+)
+"""
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Notes to process, kept in an SQLite file shared by all workers.
+
+    A note is pending, leased to one worker, done or dead. Every change is a
+    short immediate transaction, so processes on this machine, or on others
+    sharing the file over a file system with working locks, never claim the
+    same note twice while its lease lasts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.worker = worker_name()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(SCHEMA)
+
+    def transaction(self):
+        self.connection.execute("begin immediate")
+        return self.connection
+
+    def enqueue(self, note_ids) -> int:
+        """Add notes as pending, return how many were added or pending again.
+
+        A done note that is unprocessed again, its tag removed to redo it,
+        is pending with a fresh set of attempts; other notes already known
+        keep their state."""
+        connection = self.transaction()
+        try:
+            before = connection.total_changes
+            connection.executemany(
+                "insert into notes (note_id, updated) values (?, ?)"
+                " on conflict (note_id) do update set state = 'pending', attempts = 0,"
+                " error = null, updated = excluded.updated where state = 'done'",
+                [(note_id, time.time()) for note_id in note_ids])
+            added = connection.total_changes - before
+            connection.execute("commit")
+        except BaseException:
+            connection.execute("rollback")
+            raise
+        return added
+
+    def claim(self):
+        """Lease the next pending note, or one whose lease ran out; None if there is none.
+
+        A note whose lease ran out on its last attempt is dead instead, a
+        note that kills its worker must not be handed out forever."""
+        now = time.time()
+        connection = self.transaction()
+        try:
+            connection.execute(
+                "update notes set state = 'dead', error = 'lease ran out', worker = null,"
+                " lease_until = null, updated = ?"
+                " where state = 'leased' and lease_until < ? and attempts >= ?",
+                (now, now, max_attempts))
+            row = connection.execute(
+                "select note_id from notes"
+                " where state = 'pending' or (state = 'leased' and lease_until < ?)"
+                " order by attempts, note_id limit 1", (now,)).fetchone()
+            if row is not None:
+                connection.execute(
+                    "update notes set state = 'leased', attempts = attempts + 1,"
+                    " worker = ?, lease_until = ?, updated = ? where note_id = ?",
+                    (self.worker, now + lease_seconds, now, row[0]))
+            connection.execute("commit")
+        except BaseException:
+            connection.execute("rollback")
+            raise
+        return None if row is None else row[0]
+
+    def renew(self, note_id) -> bool:
+        """Extend the lease of a note, False if this worker does not hold it anymore."""
+        cursor = self.connection.execute(
+            "update notes set lease_until = ? where note_id = ? and state = 'leased' and worker = ?",
+            (time.time() + lease_seconds, note_id, self.worker))
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def held(self, note_id):
+        """Renew the lease of a claimed note every renew_seconds while the block runs."""
+        stop = threading.Event()
+
+        def renew():
+            # a connection of its own, the block keeps using this one
+            queue = WorkQueue(self.path)
+            queue.worker = self.worker
+            while not stop.wait(renew_seconds) and queue.renew(note_id):
+                pass
+            queue.connection.close()
+
+        thread = threading.Thread(target=renew, name=f"lease-{note_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def finish(self, note_id, error=None):
+        """Mark a leased note done, or failed with error.
+
+        A failed note is pending again until it has used max_attempts, then
+        it is dead. A worker whose lease was taken over changes nothing."""
+        connection = self.transaction()
+        try:
+            if error is None:
+                state = "done"
+            else:
+                (attempts,) = connection.execute(
+                    "select attempts from notes where note_id = ?", (note_id,)).fetchone()
+                state = "dead" if attempts >= max_attempts else "pending"
+            connection.execute(
+                "update notes set state = ?, error = ?, worker = null, lease_until = null,"
+                " updated = ? where note_id = ? and state = 'leased' and worker = ?",
+                (state, error, time.time(), note_id, self.worker))
+            connection.execute("commit")
+        except BaseException:
+            connection.execute("rollback")
+            raise
+
+    def retry_dead(self) -> int:
+        """Give every dead note a fresh set of attempts."""
+        cursor = self.connection.execute(
+            "update notes set state = 'pending', attempts = 0, updated = ? where state = 'dead'",
+            (time.time(),))
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        return dict(self.connection.execute(
+            "select state, count(*) from notes group by state").fetchall())
+
+    def dead_letters(self) -> list:
+        return self.connection.execute(
+            "select note_id, attempts, error from notes where state = 'dead'"
+            " order by note_id").fetchall()
@@ -1,8 +1,9 @@
+import os
 import requests
 import re
 
 # Define the AnkiConnect API endpoint
-ANKICONNECT_URL = "http://localhost:8765"
+ANKICONNECT_URL = os.environ.get("ANKICONNECT_URL", "http://localhost:8765")
 
 def invoke(action, params):
     return requests.post(ANKICONNECT_URL, json={"action": action, "version": 6, "params": params}).json()
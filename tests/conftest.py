@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "note_process"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+# the OpenAI client is created on import, no request is sent by these tests
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+import fake_anki  # noqa: E402
+
+
+@pytest.fixture
+def anki(tmp_path, monkeypatch):
+    """Fake AnkiConnect server with an empty collection, the media folder in tmp_path."""
+    import ankiconnect
+    import media
+
+    media_dir = tmp_path / "media"
+    media_dir.mkdir()
+    collection = fake_anki.Collection(str(media_dir))
+    server = fake_anki.serve(fake_anki.AnkiConnect(collection))
+    monkeypatch.setattr(ankiconnect, "ANKICONNECT_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(media, "media_mode", None)
+    monkeypatch.setattr(media, "media_dir", None)
+    yield collection
+    server.shutdown()
@@ -0,0 +1,24 @@
+from types import SimpleNamespace
+
+import audio
+
+
+def ffmpeg_log(monkeypatch, log):
+    monkeypatch.setattr(audio.subprocess, "run", lambda *args, **kwargs: SimpleNamespace(stderr=log))
+
+
+def test_speech_is_found_between_leading_and_trailing_silence(monkeypatch):
+    ffmpeg_log(monkeypatch, "\n".join([
+        "  Duration: 00:00:08.00, start: 0.000000, bitrate: 256 kb/s",
+        "[silencedetect @ 0x1] silence_start: 0",
+        "[silencedetect @ 0x1] silence_end: 1.5 | silence_duration: 1.5",
+        "[silencedetect @ 0x1] silence_start: 6.25",
+        "[silencedetect @ 0x1] silence_end: 8 | silence_duration: 1.75",
+    ]))
+    assert audio.detect_speech("clip.wav") == (1.5, 6.25)
+
+
+def test_audio_without_duration_is_not_trimmed(monkeypatch):
+    ffmpeg_log(monkeypatch, "  Duration: N/A, bitrate: N/A\n"
+                            "[silencedetect @ 0x1] silence_start: 0\n")
+    assert audio.detect_speech("clip.wav") == (0.0, None)
@@ -0,0 +1,25 @@
+import fake_anki
+
+import cassette
+import media
+from common import AudioRef
+
+
+def test_recorded_media_traffic_replays_from_other_temporary_files(anki, tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette, "path", str(tmp_path / "cassette.jsonl"))
+    monkeypatch.setattr(cassette, "recorded", None)
+    monkeypatch.setattr(media, "media_mode", "base64")
+    (tmp_path / "media" / "raw.wav").write_bytes(fake_anki.silent_wav(1.0))
+
+    def transfer(name):
+        raw = media.read_media_file("raw.wav")
+        cut = tmp_path / name
+        cut.write_bytes(raw.read())
+        media.store_media_file("sentence_audio_x.wav", AudioRef(path=str(cut)))
+        return raw.read()
+
+    monkeypatch.setattr(cassette, "mode", "record")
+    recorded = transfer("recorded.wav")
+    (tmp_path / "media" / "raw.wav").unlink()
+    monkeypatch.setattr(cassette, "mode", "replay")
+    assert transfer("replayed.wav") == recorded
@@ -0,0 +1,43 @@
+import pytest
+
+import examples
+import process
+from common import Input
+from extractor import extract_sentences_local
+
+
+def example_input(index):
+    input = Input(**examples.extract_sentences[index]["input"])
+    process.normalize_input(input)
+    return input
+
+
+@pytest.mark.parametrize("index", [0, 2])
+def test_aligned_subtitles_are_extracted_like_the_examples(index):
+    extracted = extract_sentences_local(example_input(index))
+    assert extracted is not None
+    assert extracted.model_dump() == examples.extract_sentences[index]["output"]
+
+
+def test_subtitles_with_different_line_counts_are_left_to_the_model():
+    assert extract_sentences_local(example_input(1)) is None
+
+
+def test_untranslated_english_subtitle_is_left_to_the_model():
+    assert extract_sentences_local(example_input(3)) is None
+
+
+def test_segment_is_split_at_its_punctuation():
+    extracted = extract_sentences_local(Input(
+        vocabulary="分かる", guide="わかったよ",
+        subtitle_japanese="うん。 わかったよ\nじゃあね！",
+        subtitle_english="Yeah. Got it.\nBye!"))
+    assert extracted.sentence_japanese == "わかったよ。"
+    assert extracted.sentence_english == "Got it."
+
+
+def test_unequal_sentence_counts_are_left_to_the_model():
+    assert extract_sentences_local(Input(
+        vocabulary="分かる", guide="わかったよ",
+        subtitle_japanese="うん。わかったよ。行こう",
+        subtitle_english="Yeah, I got it. Let's go.")) is None
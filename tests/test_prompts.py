@@ -0,0 +1,22 @@
+import audio
+import examples
+import process
+from common import estimate_tokens
+from prompts import cache_prefix_tokens
+
+
+def test_static_prefix_is_cacheable_and_identical_across_inputs():
+    prompt = audio.FIND_JAPANESE_SENTENCE
+    first = prompt.messages("今日は雨が降る", "{}")
+    second = prompt.messages("明日は晴れる", "{}")
+    assert first[0] == second[0]
+    assert estimate_tokens(first[0]["content"]) >= cache_prefix_tokens
+    # the selected examples come after the prefix, before the payload
+    assert len(first) == 3 and first[-1]["role"] == "user"
+
+
+def test_short_example_sets_are_all_in_the_prefix():
+    prompt = process.EXTRACT_SENTENCES
+    assert prompt.index is None
+    assert prompt.static.endswith(prompt.render(examples.extract_sentences))
+    assert len(prompt.messages("x", "{}")) == 2
@@ -0,0 +1,78 @@
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import openai
+
+import common
+import hedging
+import ratelimit
+
+
+def error(kind, status, headers=None):
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return kind("error", response=response, body=None)
+
+
+def answers(*outcomes):
+    """call() that raises or answers the outcomes in turn, and the times it was called."""
+    calls = []
+
+    def call():
+        outcome = outcomes[len(calls)]
+        calls.append(time.monotonic())
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(headers={}, parse=lambda: outcome)
+
+    return call, calls
+
+
+def test_client_leaves_retrying_to_the_limiter():
+    assert common.client.max_retries == 0
+
+
+def test_rate_limited_request_is_requeued(monkeypatch):
+    monkeypatch.setitem(ratelimit.buckets, "test", ratelimit.Bucket("test"))
+    stats = Counter()
+    call, calls = answers(
+        error(openai.RateLimitError, 429, {"retry-after-ms": "10"}), "answer")
+    assert ratelimit.run("test", 10, call, stats) == "answer"
+    assert len(calls) == 2
+    assert stats["test.rate_limited"] == 1
+
+
+def test_server_errors_are_retried_a_bounded_number_of_times(monkeypatch):
+    monkeypatch.setitem(ratelimit.buckets, "test", ratelimit.Bucket("test"))
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    stats = Counter()
+    call, calls = answers(*[error(openai.InternalServerError, 500)] * (ratelimit.error_retries + 1))
+    try:
+        ratelimit.run("test", 10, call, stats)
+    except openai.InternalServerError:
+        pass
+    else:
+        raise AssertionError("the last server error is raised")
+    assert len(calls) == ratelimit.error_retries + 1
+    assert stats["test.retried"] == ratelimit.error_retries
+
+
+def test_throttle_wait_does_not_count_against_the_stage_deadline(monkeypatch):
+    bucket = ratelimit.Bucket("test", requests=600)
+    bucket.level["requests"] = 0.0
+    monkeypatch.setitem(ratelimit.buckets, "test", bucket)
+    monkeypatch.setattr(hedging, "default_deadline", 0.05)
+    stats = Counter()
+    call, calls = answers("answer")
+    began = time.monotonic()
+    answer = ratelimit.run(
+        "test", 0, lambda: hedging.run("test", lambda timeout: call(), stats), stats)
+    assert answer == "answer"
+    assert calls[0] - began >= 0.09
+    assert stats["test.throttled"] == 1
+
+
+def test_rate_limit_pause_waits_for_one_request_once_limits_are_known():
+    assert ratelimit.retry_after({}, 3, ratelimit.Bucket("test", requests=60)) == 0.0
+    assert ratelimit.retry_after({}, 3, ratelimit.Bucket("test")) == 8
+    assert ratelimit.retry_after({"retry-after": "2"}, 3, ratelimit.Bucket("test", requests=60)) == 2
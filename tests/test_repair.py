@@ -0,0 +1,48 @@
+import json
+from types import SimpleNamespace
+
+import common
+import process
+from common import Extracted, Input
+
+
+def answer_with(monkeypatch, answers):
+    """Answer chat_parse with the given Extracted in turn, return the requests."""
+    requests = []
+
+    def chat_parse(stage="chat", **request):
+        requests.append(request)
+        parsed = answers[len(requests) - 1]
+        message = SimpleNamespace(parsed=parsed, content=json.dumps(parsed.model_dump()))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(common, "chat_parse", chat_parse)
+    return requests
+
+
+def unaligned_input():
+    # no guide, so the local extractor leaves the note to the model
+    return Input(vocabulary="分かる", guide="", subtitle_japanese="えっ\nわかったよ",
+                 subtitle_english="What?\nGot it.")
+
+
+def test_kana_spelling_of_the_vocabulary_needs_no_repair(monkeypatch):
+    requests = answer_with(monkeypatch, [
+        Extracted(sentence_japanese="わかったよ。", sentence_english="Got it."),
+    ])
+    extracted = process.extract_sentences(unaligned_input())
+    assert extracted.sentence_japanese == "わかったよ。"
+    assert len(requests) == 1
+
+
+def test_only_text_changed_by_the_model_is_sent_back(monkeypatch):
+    monkeypatch.setattr(common, "repair_attempts", 1)
+    requests = answer_with(monkeypatch, [
+        Extracted(sentence_japanese="分かるよ。", sentence_english="Got it."),
+        Extracted(sentence_japanese="わかったよ。", sentence_english="Got it."),
+    ])
+    extracted = process.extract_sentences(unaligned_input())
+    assert extracted.sentence_japanese == "わかったよ。"
+    repair = requests[1]["messages"][-1]["content"]
+    assert "is not taken from the subtitle" in repair
+    assert "keeping the text of the input as it is" in repair
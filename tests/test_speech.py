@@ -0,0 +1,69 @@
+import artifacts
+import audio
+import process
+import speech
+from common import AudioRef, Input
+
+
+def test_batching_keeps_the_keys_of_stored_transcriptions(tmp_path, monkeypatch):
+    clip = tmp_path / "clip.mp3"
+    clip.write_bytes(b"audio")
+    input = Input(vocabulary="分かる", guide="", subtitle_japanese="わかったよ", subtitle_english="Got it.")
+    monkeypatch.setattr(speech, "backend", speech.OpenAIBackend())
+    key = audio.transcription_key(str(clip))
+    fingerprints = process.stage_fingerprints(input, "clip.mp3")
+
+    speech.use_batching(max_clips=4)
+    assert audio.transcription_key(str(clip)) == key
+    assert process.stage_fingerprints(input, "clip.mp3") == fingerprints
+
+    monkeypatch.setattr(speech, "backend", speech.LocalWhisperBackend(model_size="small"))
+    assert audio.transcription_key(str(clip)) != key
+
+
+class StubBackend:
+    def __init__(self, words=None):
+        self.words = words or [dict(word="わかった", start=0.0, end=0.5)]
+        self.hints = []
+
+    def parameters(self):
+        return dict(backend="stub")
+
+    def transcribe(self, audio_path, sentence):
+        self.hints.append(sentence)
+        return self.words
+
+
+def test_edited_sentence_reuses_the_stored_transcription(tmp_path, monkeypatch):
+    clip = tmp_path / "clip.mp3"
+    clip.write_bytes(b"audio")
+    backend = StubBackend()
+    monkeypatch.setattr(speech, "backend", backend)
+    monkeypatch.setattr(audio, "downsample", False)
+    monkeypatch.setattr(artifacts, "path", str(tmp_path / "artifacts"))
+    monkeypatch.setattr(artifacts, "connection", None)
+    words = audio.transcribe_audio(str(clip), "わかったよ。")
+    assert audio.transcribe_audio(str(clip), "わかった。") == words
+    assert backend.hints == ["わかったよ。"]
+
+
+def test_joined_transcription_goes_back_to_the_clips(tmp_path, monkeypatch):
+    joined = tmp_path / "joined.mp3"
+    joined.write_bytes(b"audio")
+    monkeypatch.setattr(speech, "encode_mp3", lambda pcm: AudioRef(path=str(joined)))
+    inner = StubBackend([
+        dict(word="わかった", start=0.2, end=0.6),
+        # reaches into the gap after the first clip
+        dict(word="よ", start=1.3, end=1.6),
+        dict(word="うん", start=2.5, end=3.0),
+        dict(word="？", start=None, end=None),
+    ])
+    batching = speech.BatchingBackend(inner, gap=1.0)
+    second = speech.BYTES_PER_SECOND
+    batch = [("first.mp3", bytes(second), "わかったよ。", None),
+             ("second.mp3", bytes(2 * second), "うん。", None)]
+    first_words, second_words = batching.transcribe_joined(batch)
+    assert inner.hints == ["わかったよ。 うん。"]
+    assert first_words == [dict(word="わかった", start=0.2, end=0.6),
+                           dict(word="よ", start=1.0, end=1.0)]
+    assert second_words == [dict(word="うん", start=0.5, end=1.0)]
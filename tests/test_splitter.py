@@ -0,0 +1,38 @@
+import pytest
+
+from common import Triplet
+from splitter import split_furigana, split_japanese
+
+GINKOU = "<ruby>銀行<rt>ぎんこう</rt></ruby> に <ruby>行<rt>い</rt></ruby>った。"
+
+
+def test_stem_inside_a_compound_is_skipped():
+    furigana = split_furigana("行く", GINKOU)
+    assert furigana == Triplet(
+        prefix="<ruby>銀行<rt>ぎんこう</rt></ruby> に ",
+        middle="<ruby>行<rt>い</rt></ruby>った",
+        suffix="。")
+    assert split_japanese("行く", "銀行に行った。", furigana) == Triplet(
+        prefix="銀行に", middle="行った", suffix="。")
+
+
+@pytest.mark.parametrize("vocabulary, sentence", [
+    # another verb on the same kanji
+    ("見る", "<ruby>見<rt>み</rt></ruby>せて"),
+    # the stem is only part of a ruby base
+    ("行く", "<ruby>銀行<rt>ぎんこう</rt></ruby>かな"),
+    # the stem follows a kanji
+    ("行く", "<ruby>銀<rt>ぎん</rt></ruby><ruby>行<rt>こう</rt></ruby>から"),
+])
+def test_unsure_stem_matches_are_left_to_the_model(vocabulary, sentence):
+    assert split_furigana(vocabulary, sentence) is None
+
+
+@pytest.mark.parametrize("vocabulary, sentence, middle", [
+    ("見る", "<ruby>映画<rt>えいが</rt></ruby> を <ruby>見<rt>み</rt></ruby>た", "<ruby>見<rt>み</rt></ruby>た"),
+    ("分かる", "<ruby>分<rt>わ</rt></ruby>かった よ", "<ruby>分<rt>わ</rt></ruby>かった"),
+    ("勉強する", "<ruby>勉強<rt>べんきょう</rt></ruby>しました", "<ruby>勉強<rt>べんきょう</rt></ruby>しました"),
+    ("正式", "<ruby>正式<rt>せいしき</rt></ruby> に", "<ruby>正式<rt>せいしき</rt></ruby>"),
+])
+def test_words_are_highlighted(vocabulary, sentence, middle):
+    assert split_furigana(vocabulary, sentence).middle == middle
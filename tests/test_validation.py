@@ -0,0 +1,52 @@
+import pytest
+
+from common import Extracted, ExtractedSplit, InvalidResponse, Input, Triplet, stats
+from validation import check_extracted, check_extracted_split, check_ruby
+
+
+def extracted_from(vocabulary, subtitle, sentence):
+    return (Input(vocabulary=vocabulary, guide="", subtitle_japanese=subtitle,
+                  subtitle_english="..."),
+            Extracted(sentence_japanese=sentence, sentence_english="..."))
+
+
+@pytest.mark.parametrize("vocabulary, subtitle, sentence", [
+    ("分かる", "わかったよ", "わかったよ。"),
+    ("いう", "何て\nいったよ", "何ていったよ。"),
+    ("煩い", "（太郎）うるさいな", "「うるさいな」"),
+])
+def test_conjugated_or_kana_vocabulary_is_accepted(vocabulary, subtitle, sentence):
+    before = stats["validation.vocabulary_not_found"]
+    check_extracted(*extracted_from(vocabulary, subtitle, sentence))
+    assert stats["validation.vocabulary_not_found"] == before + 1
+
+
+def test_sentence_rewritten_to_fit_the_vocabulary_is_rejected():
+    with pytest.raises(InvalidResponse):
+        check_extracted(*extracted_from("分かる", "わかったよ", "分かるよ。"))
+
+
+def test_empty_english_sentence_is_rejected():
+    input, extracted = extracted_from("分かる", "わかったよ", "わかったよ。")
+    extracted.sentence_english = " "
+    with pytest.raises(InvalidResponse):
+        check_extracted(input, extracted)
+
+
+def test_ruby_must_be_well_formed():
+    check_ruby("<ruby>分<rt>わ</rt></ruby>かった", "分かった")
+    with pytest.raises(InvalidResponse):
+        check_ruby("<ruby>分<rt>わ</ruby>かった", "分かった")
+    with pytest.raises(InvalidResponse):
+        check_ruby("<ruby>分<rt>わ</rt></ruby>かる", "分かった")
+
+
+def test_fused_split_needs_an_english_middle():
+    input, _ = extracted_from("分かる", "わかったよ", "わかったよ。")
+    split = ExtractedSplit(
+        sentence_japanese=Triplet(prefix="", middle="わかった", suffix="よ。"),
+        sentence_english=Triplet(prefix="Got it.", middle=" ", suffix=""))
+    with pytest.raises(InvalidResponse, match="empty middle"):
+        check_extracted_split(input, split)
+    split.sentence_english = Triplet(prefix="", middle="Got it", suffix=".")
+    check_extracted_split(input, split)
@@ -0,0 +1,24 @@
+import cleanup
+
+
+def test_watcher_survives_failed_polls_and_notes(monkeypatch):
+    polls = [ConnectionError("Anki is closed"), [1, 2], KeyboardInterrupt()]
+    processed = []
+
+    def get_note_ids_with_tag(tag, query=""):
+        outcome = polls.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def process_note_by_id(note_id):
+        processed.append(note_id)
+        if note_id == 1:
+            raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(cleanup, "get_note_ids_with_tag", get_note_ids_with_tag)
+    monkeypatch.setattr(cleanup, "process_note_by_id", process_note_by_id)
+    monkeypatch.setattr(cleanup.time, "sleep", lambda seconds: None)
+    cleanup.watch_notes(interval=1)
+    assert processed == [1, 2]
+    assert not polls
@@ -0,0 +1,58 @@
+import time
+
+import workqueue
+
+
+def two_workers(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    first, second = workqueue.WorkQueue(path), workqueue.WorkQueue(path)
+    second.worker = "other:1"
+    first.enqueue([1])
+    return first, second
+
+
+def test_expired_lease_is_taken_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(workqueue, "lease_seconds", 0.2)
+    first, second = two_workers(tmp_path)
+    assert first.claim() == 1
+    assert second.claim() is None
+    time.sleep(0.3)
+    assert second.claim() == 1
+    # the first worker learns it lost the note before writing it back
+    assert not first.renew(1)
+    first.finish(1)
+    assert second.counts() == {"leased": 1}
+
+
+def test_held_lease_is_renewed(tmp_path, monkeypatch):
+    monkeypatch.setattr(workqueue, "lease_seconds", 0.3)
+    monkeypatch.setattr(workqueue, "renew_seconds", 0.05)
+    first, second = two_workers(tmp_path)
+    assert first.claim() == 1
+    with first.held(1):
+        time.sleep(0.6)
+        assert second.claim() is None
+        assert first.renew(1)
+    first.finish(1)
+    assert first.counts() == {"done": 1}
+
+
+def test_expired_lease_of_the_last_attempt_is_dead(tmp_path, monkeypatch):
+    monkeypatch.setattr(workqueue, "lease_seconds", 0.1)
+    monkeypatch.setattr(workqueue, "max_attempts", 2)
+    first, second = two_workers(tmp_path)
+    assert first.claim() == 1
+    time.sleep(0.2)
+    assert second.claim() == 1
+    time.sleep(0.2)
+    assert first.claim() is None
+    assert first.dead_letters() == [(1, 2, "lease ran out")]
+
+
+def test_done_note_enqueued_again_is_pending(tmp_path):
+    first, second = two_workers(tmp_path)
+    assert first.claim() == 1
+    first.finish(1)
+    assert first.enqueue([1, 2]) == 2
+    assert first.counts() == {"pending": 2}
+    assert first.enqueue([1, 2]) == 0
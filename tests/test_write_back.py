@@ -0,0 +1,75 @@
+import fake_anki
+
+import cleanup
+import fingerprints
+from common import AudioRef, Input, Triplet
+
+
+def add_mining_note(collection, media_dir):
+    with open(f"{media_dir}/raw.wav", "wb") as audio_file:
+        audio_file.write(fake_anki.silent_wav(1.0))
+    return collection.add_note("Mining", {
+        "Raw Yomitan Expression": "分かる",
+        "Raw Sentence Audio": "[sound:raw.wav]",
+        "Sentence Japanese": "",
+        "Sentence Furigana": "",
+        "Sentence English": "",
+        "Sentence Audio": "",
+    })
+
+
+def test_unversioned_multi_actions_get_raw_results(anki):
+    note_id = add_mining_note(anki, anki.media_dir)
+    connect = fake_anki.AnkiConnect(anki)
+    results = connect.multi([
+        dict(action="updateNoteFields", params=dict(note=dict(id=note_id, fields={}))),
+        dict(action="updateNoteFields", version=6, params=dict(note=dict(id=note_id, fields={}))),
+        dict(action="noSuchAction", version=6),
+    ])
+    assert results[0] is None
+    assert results[1] == dict(result=None, error=None)
+    assert results[2]["error"] == "unsupported action noSuchAction"
+
+
+def cut_job(anki, cut_path):
+    """A job of a new mining note, processed up to its cut audio."""
+    note_id = add_mining_note(anki, anki.media_dir)
+    cut_path.write_bytes(fake_anki.silent_wav(0.5))
+    job = cleanup.NoteJob(anki.notes[note_id])
+    job.input = Input(vocabulary="分かる", guide="", subtitle_japanese="わかったよ",
+                      subtitle_english="Got it.")
+    job.split_out = [
+        Triplet(prefix="", middle="わかった", suffix="よ"),
+        Triplet(prefix="", middle="わかった", suffix="よ"),
+        Triplet(prefix="", middle="Got it", suffix="."),
+    ]
+    job.cut = AudioRef(path=str(cut_path))
+    return job
+
+
+def test_write_back_updates_and_tags_notes(anki, tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprints, "path", str(tmp_path / "fingerprints.sqlite"))
+    monkeypatch.setattr(fingerprints, "connection", None)
+    job = cut_job(anki, tmp_path / "cut.wav")
+    note_id = job.note_id
+    cleanup.write_back([job])
+
+    note = anki.notes[note_id]
+    assert "generated-0" in note["tags"]
+    assert note["fields"]["Sentence Japanese"]["value"] == cleanup.merge_triplet(job.split_out[0])
+    assert note["fields"]["Sentence Audio"]["value"].startswith("[sound:sentence_audio_")
+    assert fingerprints.load(note_id)
+
+
+def test_failed_audio_upload_only_fails_its_own_note(anki, tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprints, "path", str(tmp_path / "fingerprints.sqlite"))
+    monkeypatch.setattr(fingerprints, "connection", None)
+    missing = cut_job(anki, tmp_path / "missing.wav")
+    (tmp_path / "missing.wav").unlink()
+    job = cut_job(anki, tmp_path / "cut.wav")
+    cleanup.write_back([missing, job])
+
+    assert "generated-0" not in anki.notes[missing.note_id]["tags"]
+    assert anki.notes[missing.note_id]["fields"]["Sentence Audio"]["value"] == ""
+    assert "generated-0" in anki.notes[job.note_id]["tags"]
+    assert fingerprints.load(job.note_id)